@@ -0,0 +1,87 @@
+"""
+Benchmark throughput of crack-seg (SegFormer, ONNX Runtime) and restore
+(CRFill, torch) running concurrently, with and without the CPU budget split
+of `src.utils.compute`.
+
+Each mode runs in its own process, since torch and ORT thread pools are
+sized once per process. Extra `COMPUTE_*` variables (e.g.
+`COMPUTE_PIN_CORES=1`) are passed through to the managed mode.
+
+Usage:
+    python -m benchmarks.concurrent_inference --seconds 20 --size 512
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+import subprocess
+import numpy as np
+
+
+def worker(args):
+    from scripts.quantize_models import synthetic_mask
+    from src.controllers.crack_detection.seg_former import FormerCrackSeg
+    from src.controllers.restoration.crfill import CRFillRestorationProvider
+    from src.utils.compute import Compute
+
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (args.size, args.size, 3), dtype=np.uint8)
+    mask = synthetic_mask(args.size, args.size, rng)
+    segformer = FormerCrackSeg(max_batch_size=1)
+    crfill = CRFillRestorationProvider(server="torch")
+
+    calls = {
+        "crack_seg": lambda: segformer.predict([image]),
+        "restore": lambda: crfill.infer([image], [mask]),
+    }
+    for fn in calls.values():
+        fn()
+
+    counts = {name: 0 for name in calls}
+    deadline = time.perf_counter() + args.seconds
+
+    def _loop(name):
+        while time.perf_counter() < deadline:
+            calls[name]()
+            counts[name] += 1
+
+    threads = [threading.Thread(target=_loop, args=(name,)) for name in calls]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    print(json.dumps({"throughput": {k: v / args.seconds for k, v in counts.items()},
+                      "compute": Compute.snapshot()}))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--size", type=int, default=512,
+                        help="Square image size, multiple of 8")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        return worker(args)
+
+    print(f"| {'Mode':<9} | {'crack_seg img/s':>15} | {'restore img/s':>13} | {'torch/ORT threads':<24} |")
+    print(f"| {'-'*9} | {'-'*15} | {'-'*13} | {'-'*24} |")
+    for mode, managed in (("unmanaged", "0"), ("managed", "1")):
+        _env = {**os.environ, "COMPUTE_MANAGED": managed}
+        _output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.concurrent_inference", "--worker",
+             "--seconds", str(args.seconds), "--size", str(args.size)],
+            env=_env, check=True, capture_output=True, text=True).stdout
+        _result = json.loads(_output.strip().splitlines()[-1])
+        _throughput, _compute = _result["throughput"], _result["compute"]
+        _threads = "all" if not _compute["managed"] else f"{_compute['torch']['threads']}/" + ",".join(
+            str(a["threads"]) for a in _compute["ort"].values())
+        print(f"| {mode:<9} | {_throughput['crack_seg']:>15.2f} | {_throughput['restore']:>13.2f} | {_threads:<24} |")
+
+
+if __name__ == "__main__":
+    main()
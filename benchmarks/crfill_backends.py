@@ -0,0 +1,65 @@
+"""
+Benchmark CRFill inference on the eager torch backend against TorchScript
+(`TORCH_COMPILE=script`) and ONNX Runtime across image sizes.
+
+Needs the dynamic-axes ONNX model from `python -m scripts.export_crfill_onnx`.
+Random images with a random stroke mask are used; all backends receive the
+same inputs through `CRFillRestorationProvider.infer`, so pre/post-processing
+is included in the timings.
+
+Usage:
+    python -m benchmarks.crfill_backends --sizes 256 512 1024 --batch 1
+"""
+import time
+import argparse
+import numpy as np
+from scripts.quantize_models import synthetic_mask
+from src.controllers.restoration.crfill import CRFillRestorationProvider, DefaultConfig
+
+
+class ScriptConfig(DefaultConfig):
+    torch_compile = "script"
+    warmup_shapes = ""
+
+
+def measure(provider: CRFillRestorationProvider, images, masks, repeats: int) -> float:
+    # Warm up, first calls allocate arenas, select kernels and let the
+    # TorchScript profiling executor specialize
+    for _ in range(2):
+        provider.infer(images, masks)
+
+    _s = time.perf_counter()
+    for _ in range(repeats):
+        provider.infer(images, masks)
+    return (time.perf_counter() - _s) / (repeats * len(images)) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[256, 512, 1024],
+                        help="Square image sizes, multiples of 4")
+    parser.add_argument("--batch", type=int, default=1)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    backends = {
+        "torch": CRFillRestorationProvider(server="torch"),
+        "script": CRFillRestorationProvider(config=ScriptConfig, server="torch"),
+        "onnx": CRFillRestorationProvider(server="onnx"),
+    }
+
+    rng = np.random.default_rng(0)
+    print("| Size      | " + " | ".join(f"{f'{name} ms / image':>17}" for name in backends) + " |")
+    print("| --------- | " + " | ".join("-" * 17 for _ in backends) + " |")
+    for size in args.sizes:
+        images = [rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+                  for _ in range(args.batch)]
+        masks = [synthetic_mask(size, size, rng) for _ in range(args.batch)]
+
+        _latencies = [measure(backend, images, masks, args.repeats)
+                      for backend in backends.values()]
+        print(f"| {f'{size}x{size}':<9} | " + " | ".join(f"{ms:>17.1f}" for ms in _latencies) + " |")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+Benchmark knowledge-chunk retrieval against sending the full knowledge.
+
+Each sample question is asked once per mode, in its own conversation, with
+the answers cache off. The table reports the prompt tokens (as estimated by
+`llm.prompt_tokens`), the time to first token and the total time.
+
+By default the provider is an offline fake answering instantly, so the
+latency columns only show the local overhead (retrieval and prompt
+building); pass `--provider gemini` or `--provider gpt` to measure the real
+provider, which needs the API keys of the server `.env`.
+
+Usage:
+    python -m benchmarks.llm_retrieval --provider gemini
+    python -m benchmarks.llm_retrieval --knowledge exhibit.txt --questions questions.txt
+"""
+import time
+import asyncio
+import argparse
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage
+import src.controllers.llm as llm
+from src.utils.metrics import Metrics
+
+
+SampleKnowledge = """Trống đồng Ngọc Lũ là một trong những chiếc trống đồng Đông Sơn lớn và đẹp nhất từng được phát hiện. Trống được tìm thấy năm 1893 khi người dân đắp đê ở làng Ngọc Lũ, huyện Bình Lục, tỉnh Hà Nam. Sau đó trống được đưa về chùa làng và đến năm 1903 thì được chuyển cho Trường Viễn Đông Bác Cổ.
+Trống có đường kính mặt khoảng 79 cm, cao khoảng 63 cm và nặng gần 86 kg. Trống được đúc bằng đồng thau theo kỹ thuật khuôn hai mang, thành trống mỏng và đều, cho thấy trình độ luyện kim rất cao của cư dân Đông Sơn.
+Giữa mặt trống là ngôi sao mười bốn cánh, xen giữa các cánh là họa tiết lông công. Bao quanh ngôi sao là mười sáu vành hoa văn đồng tâm, gồm các vòng tròn có chấm giữa, vạch song song và răng cưa.
+Vành hoa văn chính trên mặt trống khắc cảnh sinh hoạt: người hóa trang lông chim nhảy múa, người giã gạo chày tay, người đánh trống và thổi khèn, cùng những ngôi nhà sàn mái cong hình thuyền. Đây là nguồn tư liệu quý về đời sống tinh thần của người Việt cổ.
+Vành ngoài của mặt trống có đàn chim lạc và chim cò bay ngược chiều kim đồng hồ, xen kẽ với hươu nai đang chạy. Hình chim lạc về sau trở thành biểu tượng quen thuộc của văn hóa Đông Sơn.
+Tang trống khắc sáu chiếc thuyền chở chiến binh đội mũ lông chim, cầm giáo, rìu và cung nỏ. Dưới mỗi thuyền có cá và chim nước, gợi ý các lễ hội đua thuyền hoặc nghi lễ tiễn đưa linh hồn.
+Thân trống được chia thành các ô dọc, trong mỗi ô có hình chiến binh cầm vũ khí và đội mũ lông chim. Chân trống để trơn, không trang trí, loe ra tạo thế vững chắc khi đặt trống.
+Trống đồng Ngọc Lũ được xác định có niên đại khoảng thế kỷ thứ ba đến thế kỷ thứ hai trước Công nguyên. Trống thuộc loại Heger I, nhóm trống cổ nhất và đẹp nhất trong hệ thống phân loại trống đồng Đông Nam Á.
+Năm 2012, trống đồng Ngọc Lũ được Thủ tướng Chính phủ công nhận là Bảo vật quốc gia trong đợt đầu tiên. Hiện nay trống được trưng bày tại Bảo tàng Lịch sử Quốc gia ở Hà Nội.
+Trống đồng không chỉ là nhạc khí dùng trong lễ hội mà còn là biểu tượng quyền lực của thủ lĩnh. Tiếng trống được dùng để cầu mưa, tập hợp cộng đồng và cổ vũ chiến binh khi ra trận.
+"""
+
+SampleQuestions = [
+    "Trống đồng Ngọc Lũ được tìm thấy ở đâu và vào năm nào?",
+    "Trống nặng bao nhiêu kg?",
+    "Giữa mặt trống có hình gì?",
+    "Trên tang trống khắc những gì?",
+    "Trống có niên đại bao nhiêu năm?",
+    "Hiện nay trống được trưng bày ở đâu?",
+    "Trống đồng được dùng để làm gì?",
+    "Hình chim lạc có ý nghĩa gì?",
+]
+
+
+def prompt_total() -> float:
+    _metric = Metrics.snapshot()["metrics"].get("llm.prompt_tokens", {"count": 0})
+    return _metric.get("mean", 0) * _metric["count"]
+
+
+async def ask(controller: llm.LLMController, provider: llm.LLMProvider, question: str, knowledge: str, client_id: str):
+    _tokens = prompt_total()
+    _s = time.perf_counter()
+    _first = None
+    async for _ in controller.astream(question, knowledge, provider=provider, client_id=client_id):
+        _first = _first or time.perf_counter()
+    _end = time.perf_counter()
+    return prompt_total() - _tokens, ((_first or _end) - _s) * 1000, (_end - _s) * 1000
+
+
+async def run(args, knowledge: str, questions: list[str]):
+    provider = llm.LLMProvider(args.provider or "gemini")
+    if args.provider is None:
+        llm.PROVIDERS["gemini"] = GenericFakeChatModel(
+            messages=iter([AIMessage("Câu trả lời mẫu.")] * 2 * len(questions)))
+
+    controller = llm.LLMController()
+    controller.cache.enabled = False
+    print(f"Knowledge: {llm.count_tokens(knowledge)} tokens, {len(questions)} questions")
+    print(f"| {'Mode':<9} | {'Prompt tokens':>13} | {'TTFT ms':>9} | {'Total ms':>9} |")
+    print(f"| {'-'*9} | {'-'*13} | {'-'*9} | {'-'*9} |")
+    for mode, enabled in (("full", False), ("retrieval", True)):
+        controller.retriever.enabled = enabled
+        _rows = [await ask(controller, provider, q, knowledge, f"bench-{mode}-{i}")
+                 for i, q in enumerate(questions)]
+        _tokens, _ttft, _total = (sum(_c) / len(_rows) for _c in zip(*_rows))
+        print(f"| {mode:<9} | {_tokens:>13.0f} | {_ttft:>9.1f} | {_total:>9.1f} |")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--provider", choices=["gemini", "gpt"], default=None,
+                        help="Real provider to call, an offline fake when omitted")
+    parser.add_argument("--knowledge", help="Knowledge text file, a sample exhibit by default")
+    parser.add_argument("--questions", help="File with one question a line")
+    args = parser.parse_args()
+
+    knowledge = SampleKnowledge
+    if args.knowledge:
+        with open(args.knowledge, encoding="utf-8") as f:
+            knowledge = f.read()
+    questions = SampleQuestions
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [_line.strip() for _line in f if _line.strip()]
+    asyncio.run(run(args, knowledge, questions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark of SegFormer pre/post-processing on 4K inputs.
+
+Compares the legacy per-image PIL/numpy pipeline with `SegFormerProcessor`.
+The model itself is not run; a random probability map of the model output
+shape stands in for the prediction.
+
+Usage:
+    python -m benchmarks.segformer_processing --images 8 --input-size 512
+"""
+import argparse
+import time
+import tracemalloc
+import numpy as np
+import cv2 as cv
+from PIL import Image
+from src.controllers.crack_detection.seg_former._processing import SegFormerProcessor
+
+
+def legacy_preprocess(pil_image, input_size):
+    re_image = pil_image.resize((input_size, input_size))
+    image_data = np.asarray(re_image).astype('float32')
+    image_data = image_data.transpose(2, 0, 1)
+    return np.expand_dims(image_data, axis=0)
+
+
+def legacy_postprocess(prob, size, threshold):
+    image_w, image_h = size
+    mask_seg = cv.resize(prob, (image_w, image_h), interpolation=cv.INTER_AREA)
+    crack_mask = mask_seg * 255
+    crack_mask[crack_mask < threshold * 255] = 0
+    return Image.fromarray(crack_mask.astype(np.uint8)).convert("L")
+
+
+def run_legacy(images, prob, input_size, threshold):
+    for image in images:
+        legacy_preprocess(image, input_size)
+        legacy_postprocess(prob, image.size, threshold)
+
+
+def run_processor(processor, images, prob, threshold):
+    for image in images:
+        processor.preprocess([image])
+        processor.postprocess(prob, image.size, threshold)
+
+
+def measure(name, fn, n_images, repeats):
+    # Warm up so reused buffers are already allocated
+    fn()
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    _s = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    _elapsed = time.perf_counter() - _s
+    _, _peak = tracemalloc.get_traced_memory()
+    _snapshot = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    _n = n_images * repeats
+    print(f"| {name:<10} | {_elapsed / _n * 1000:>10.2f} | {_peak / 2**20:>14.1f} |")
+    return _snapshot
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", type=int, default=8)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--input-size", type=int, default=512)
+    parser.add_argument("--threshold", type=float, default=0.65)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    images = [Image.fromarray(rng.integers(0, 256, (2160, 3840, 3), dtype=np.uint8))
+              for _ in range(args.images)]
+    prob = rng.random((args.input_size, args.input_size), dtype=np.float32)
+    processor = SegFormerProcessor([1, 3, args.input_size, args.input_size])
+
+    # Check both pipelines agree before timing
+    for image in images[:2]:
+        _legacy = np.asarray(legacy_postprocess(prob, image.size, args.threshold))
+        _new = np.asarray(processor.postprocess(prob, image.size, args.threshold))
+        assert np.abs(_legacy.astype(int) - _new).max() <= 1
+
+    print(f"| {'Pipeline':<10} | {'ms / image':>10} | {'peak numpy MB':>14} |")
+    print(f"| {'-'*10} | {'-'*10} | {'-'*14} |")
+    measure("legacy", lambda: run_legacy(
+        images, prob, args.input_size, args.threshold), args.images, args.repeats)
+    measure("processor", lambda: run_processor(
+        processor, images, prob, args.threshold), args.images, args.repeats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Export the CRFill generator to ONNX with dynamic batch/height/width axes and
+check it against the eager torch model.
+
+The exported model is written to `models/crfill.onnx`, where
+`CRFillRestorationProvider` picks it up for `CRFILL_SERVER=onnx` or provider
+`crfill-onnx`, and exports it the same way at load when the file is missing
+or has a fixed input size. Inputs are `image` [b, 3, h, w] in [0, 1] and
+`mask` [b, 1, h, w]; h and w must be multiples of 4 (two stride-2 stages).
+
+The parity check runs both backends on random images/masks at each size and
+fails when the max absolute output difference (0-255 scale) exceeds
+`--tolerance`. `tests/test_crfill_onnx.py` runs the same check on a randomly
+initialized generator.
+
+Usage:
+    python -m scripts.export_crfill_onnx
+    python -m scripts.export_crfill_onnx --check-only --sizes 256x256 512x768
+"""
+import os
+import sys
+import inspect
+import argparse
+import numpy as np
+import torch
+from src.controllers.restoration.crfill import DefaultConfig
+from src.controllers.restoration.crfill.model import BaseConvGenerator
+from src.utils.downloader import download_model_from_drive
+from src.utils.onnx_infer import onnx_interence_session, onnx_inference
+
+
+def parse_size(value: str) -> tuple[int, int]:
+    _h, _, _w = value.partition("x")
+    _h, _w = int(_h), int(_w or _h)
+    if _h % 4 or _w % 4:
+        raise argparse.ArgumentTypeError(f"{value}: height and width must be multiples of 4")
+    return _h, _w
+
+
+def load_torch_model() -> BaseConvGenerator:
+    _model = BaseConvGenerator()
+    _model_path = download_model_from_drive(
+        DefaultConfig.torch_model_id, DefaultConfig.torch_model_name)
+    _model.load_state_dict(torch.load(_model_path))
+    return _model.eval()
+
+
+def export(model: BaseConvGenerator, output: str, opset: int, size: tuple[int, int]):
+    _h, _w = size
+    _image = torch.rand(1, 3, _h, _w)
+    _mask = torch.zeros(1, 1, _h, _w)
+    _mask[..., _h // 4:_h // 2, _w // 4:_w // 2] = 1
+
+    _axes = {0: "batch", 2: "height", 3: "width"}
+    _kwargs = {}
+    # Newer torch defaults to the dynamo exporter, keep the TorchScript one
+    # which handles `dynamic_axes`
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        _kwargs["dynamo"] = False
+    torch.onnx.export(
+        model, (_image, _mask), output,
+        input_names=["image", "mask"],
+        output_names=["inpainted"],
+        dynamic_axes={"image": _axes, "mask": _axes, "inpainted": _axes},
+        opset_version=opset,
+        do_constant_folding=True,
+        **_kwargs,
+    )
+    print(f"Exported {output} ({os.path.getsize(output) / 2**20:.1f} MB)")
+
+
+def check_parity(model: BaseConvGenerator, onnx_path: str, sizes: list[tuple[int, int]],
+                 batch: int, tolerance: float) -> bool:
+    _session = onnx_interence_session(onnx_path, name="crfill")
+    _rng = np.random.default_rng(0)
+    _ok = True
+
+    print(f"| {'Size':<11} | {'Max abs diff':>12} | {'Mean abs diff':>13} |")
+    print(f"| {'-'*11} | {'-'*12} | {'-'*13} |")
+    for _h, _w in sizes:
+        _images = _rng.random((batch, 3, _h, _w), dtype=np.float32)
+        _masks = (_rng.random((batch, 1, _h, _w)) > 0.8).astype(np.float32)
+
+        with torch.inference_mode():
+            _expected = model(torch.from_numpy(_images), torch.from_numpy(_masks)).numpy()
+        _actual = onnx_inference(_session, _images, _masks)
+
+        _diff = np.abs(_expected - _actual)
+        _ok &= bool(_diff.max() <= tolerance)
+        print(f"| {f'{_h}x{_w}':<11} | {_diff.max():>12.4f} | {_diff.mean():>13.5f} |")
+
+    return _ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--output", default=os.path.join(
+        os.getcwd(), "models", DefaultConfig.onnx_model_name))
+    parser.add_argument("--opset", type=int, default=17)
+    parser.add_argument("--export-size", type=parse_size, default=(256, 256),
+                        help="Dummy input size used for tracing, HxW")
+    parser.add_argument("--sizes", type=parse_size, nargs="+",
+                        default=[(256, 256), (512, 512), (480, 640)],
+                        help="Parity check sizes, HxW")
+    parser.add_argument("--batch", type=int, default=2)
+    parser.add_argument("--tolerance", type=float, default=1.0)
+    parser.add_argument("--check-only", action="store_true",
+                        help="Skip export, check an existing ONNX model")
+    args = parser.parse_args()
+
+    _model = load_torch_model()
+    if not args.check_only:
+        export(_model, args.output, args.opset, args.export_size)
+
+    if not check_parity(_model, args.output, args.sizes, args.batch, args.tolerance):
+        print(f"Parity check failed, tolerance {args.tolerance}")
+        sys.exit(1)
+    print("Parity check passed")
+
+
+if __name__ == "__main__":
+    main()
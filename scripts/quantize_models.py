@@ -0,0 +1,263 @@
+"""
+Build quantized model variants and report accuracy against latency.
+
+- SegFormer: INT8 ONNX, static (QDQ, calibrated) or dynamic, written to
+  `models/seg_former.int8.onnx`, served by provider `segformer-int8`.
+- CRFill: INT8 (static QDQ) and/or FP16 ONNX from the FP32 ONNX model with
+  dynamic height/width (exported by `scripts.export_crfill_onnx` when
+  missing), written to `models/crfill.<precision>.onnx`, served by
+  `crfill-int8` and `crfill-fp16`.
+
+Calibration and evaluation images are sampled from `data/uploads` (masks
+from `data/crackseg_masks` when available). The report compares each
+variant with the FP32 model: mask IoU for SegFormer, inpaint PSNR for CRFill.
+
+Usage:
+    python -m scripts.quantize_models segformer --method static
+    python -m scripts.quantize_models crfill --precision int8 fp16
+"""
+import os
+import glob
+import time
+import argparse
+import numpy as np
+import cv2 as cv
+from PIL import Image
+from onnxruntime.quantization import (
+    CalibrationDataReader, QuantFormat, QuantType, quantize_dynamic, quantize_static)
+from src.utils.static import StaticDirectory
+from src.utils.onnx_infer import onnx_interence_session
+
+
+def sample_paths(directory: str, n: int, seed: int = 0) -> list[str]:
+    _paths = sorted(glob.glob(os.path.join(StaticDirectory, directory, "*")))
+    _rng = np.random.default_rng(seed)
+    _rng.shuffle(_paths)
+    return _paths[:n]
+
+
+def load_images(paths: list[str], mode="RGB", size: tuple[int, int] = None) -> list[np.ndarray]:
+    _images = []
+    for _path in paths:
+        _image = Image.open(_path).convert(mode)
+        if size is not None:
+            _image = _image.resize(size)
+        _images.append(np.asarray(_image))
+    return _images
+
+
+def synthetic_mask(height: int, width: int, rng: np.random.Generator) -> np.ndarray:
+    # Random thin strokes standing in for crack masks
+    _mask = np.zeros((height, width), np.uint8)
+    for _ in range(rng.integers(1, 5)):
+        _pts = rng.integers(0, [width, height], size=(4, 2)).astype(np.int32)
+        cv.polylines(_mask, [_pts], False, 255, int(rng.integers(2, 8)))
+    return _mask
+
+
+def iou(a: np.ndarray, b: np.ndarray) -> float:
+    _a, _b = a > 0, b > 0
+    _union = np.logical_or(_a, _b).sum()
+    return 1.0 if _union == 0 else float(np.logical_and(_a, _b).sum() / _union)
+
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    _mse = np.mean((a.astype(np.float64) - b.astype(np.float64)) ** 2)
+    return float("inf") if _mse == 0 else float(10 * np.log10(255 ** 2 / _mse))
+
+
+def timed(fn, *args):
+    _s = time.perf_counter()
+    _result = fn(*args)
+    return _result, (time.perf_counter() - _s) * 1000
+
+
+class ListCalibrationReader(CalibrationDataReader):
+    def __init__(self, feeds: list[dict]):
+        self._feeds = iter(feeds)
+
+    def get_next(self):
+        return next(self._feeds, None)
+
+
+def convert_fp16(source: str, output: str):
+    """
+    FP16 copy of an ONNX model keeping FP32 inputs/outputs
+    """
+    import onnx
+    from onnxconverter_common import float16
+
+    _model = onnx.load(source)
+    _casts = {n.name for n in _model.graph.node if n.op_type == "Cast"}
+    _model = float16.convert_float_to_float16(_model, keep_io_types=True)
+
+    # The converter retypes Cast outputs but keeps their FP32 target,
+    # e.g. the `mask > 0` cast in CRFill, which ORT then rejects
+    for _node in _model.graph.node:
+        if _node.name in _casts:
+            for _attr in _node.attribute:
+                if _attr.name == "to" and _attr.i == onnx.TensorProto.FLOAT:
+                    _attr.i = onnx.TensorProto.FLOAT16
+    onnx.save(_model, output)
+
+
+def write_report(title: str, header: list[str], rows: list[list], path: str):
+    _lines = [f"## {title}", "",
+              "| " + " | ".join(header) + " |",
+              "| " + " | ".join("---" for _ in header) + " |"]
+    _lines += ["| " + " | ".join(str(c) for c in row) + " |" for row in rows]
+    _text = "\n".join(_lines) + "\n"
+    print(_text)
+    with open(path, "a") as f:
+        f.write(_text + "\n")
+
+
+def quantize_segformer(args):
+    from src.controllers.crack_detection.seg_former import FormerCrackSeg
+
+    _fp32 = FormerCrackSeg(max_batch_size=1)
+    _output = _fp32.model_path.replace(".onnx", ".int8.onnx")
+    _input_name = _fp32.session.get_inputs()[0].name
+    _images = load_images(sample_paths("uploads", args.samples))
+    if not _images:
+        raise FileNotFoundError(f"No images found in {StaticDirectory}/uploads")
+
+    if args.method == "static":
+        _feeds = [{_input_name: _fp32.processor.preprocess([i]).copy()}
+                  for i in _images[:args.calibration]]
+        quantize_static(_fp32.model_path, _output, ListCalibrationReader(_feeds),
+                        quant_format=QuantFormat.QDQ, per_channel=True,
+                        activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    else:
+        quantize_dynamic(_fp32.model_path, _output,
+                         weight_type=QuantType.QInt8)
+
+    # Compare masks of both models on the evaluation images
+    _int8 = FormerCrackSeg(max_batch_size=1, variant="int8")
+    _rows = []
+    for _name, _model in (("fp32", _fp32), ("int8", _int8)):
+        _ious, _latencies = [], []
+        for _image in _images:
+            _mask, _ms = timed(_model.infer, [_image], args.threshold)
+            _reference = _fp32.infer([_image], args.threshold)
+            _ious.append(iou(np.asarray(_mask[0]), np.asarray(_reference[0])))
+            _latencies.append(_ms)
+        _rows.append([_name, f"{np.mean(_ious):.4f}", f"{np.mean(_latencies):.1f}",
+                      f"{os.path.getsize(_model.model_path) / 2**20:.1f}"])
+
+    write_report(f"SegFormer {args.method} INT8 ({len(_images)} images, threshold {args.threshold})",
+                 ["Variant", "Mask IoU vs FP32", "ms / image", "Size MB"], _rows, args.report)
+
+
+def has_fixed_size(session) -> bool:
+    _shape = session.get_inputs()[0].shape
+    return isinstance(_shape[2], int) or isinstance(_shape[3], int)
+
+
+def crfill_source(args) -> str:
+    """
+    FP32 CRFill ONNX model with dynamic height/width, `--source` or
+    `models/crfill.onnx`, exported from the torch checkpoint when missing or
+    fixed-size
+    """
+    from scripts.export_crfill_onnx import export, load_torch_model
+    from src.controllers.restoration.crfill import DefaultConfig
+
+    if args.source:
+        return args.source
+    _source = os.path.join(os.getcwd(), "models", DefaultConfig.onnx_model_name)
+    if not os.path.exists(_source) or has_fixed_size(onnx_interence_session(_source, name="crfill")):
+        export(load_torch_model(), _source, opset=17, size=(256, 256))
+    return _source
+
+
+def quantize_crfill(args):
+    from src.controllers.restoration.crfill import CRFillRestorationProvider, DefaultConfig
+    from src.utils.downloader import download_model_from_drive
+
+    _source = crfill_source(args)
+    _session = onnx_interence_session(_source, name="crfill")
+    # Variants of a fixed-size graph would fail on every other input size
+    if has_fixed_size(_session):
+        raise ValueError(
+            f"{_source} has a fixed input size, export one with dynamic height/width "
+            "by `python -m scripts.export_crfill_onnx`")
+    _h = _w = args.size
+
+    # Calibration/evaluation pairs at the model input size
+    _rng = np.random.default_rng(0)
+    _images = load_images(sample_paths("uploads", args.samples), size=(_w, _h))
+    if not _images:
+        raise FileNotFoundError(f"No images found in {StaticDirectory}/uploads")
+    _mask_paths = sample_paths("crackseg_masks", len(_images))
+    _masks = load_images(_mask_paths, mode="L", size=(_w, _h)) if len(
+        _mask_paths) == len(_images) else [synthetic_mask(_h, _w, _rng) for _ in _images]
+
+    def _feed(image, mask):
+        return {
+            _session.get_inputs()[0].name: (image.transpose(2, 0, 1)[None] / 255).astype(np.float32),
+            _session.get_inputs()[1].name: mask[None, None].astype(np.float32),
+        }
+
+    _outputs = {"fp32-torch": download_model_from_drive(
+        DefaultConfig.torch_model_id, DefaultConfig.torch_model_name)}
+    for _precision in args.precision:
+        _outputs[_precision] = os.path.join(
+            os.path.dirname(_source), DefaultConfig.variant_model_names[_precision])
+        if _precision == "int8":
+            _feeds = [_feed(i, m) for i, m in zip(
+                _images[:args.calibration], _masks)]
+            quantize_static(_source, _outputs[_precision], ListCalibrationReader(_feeds),
+                            quant_format=QuantFormat.QDQ, per_channel=True,
+                            activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+        elif _precision == "fp16":
+            convert_fp16(_source, _outputs[_precision])
+
+    # Compare against the eager torch model
+    _torch = CRFillRestorationProvider()
+    _references = [_torch.infer([i], [m])[0]
+                   for i, m in zip(_images, _masks)]
+    _rows = []
+    for _name in ["fp32-torch", *args.precision]:
+        _provider = _torch if _name == "fp32-torch" else CRFillRestorationProvider(
+            variant=_name)
+        _psnrs, _latencies = [], []
+        for _image, _mask, _reference in zip(_images, _masks, _references):
+            _result, _ms = timed(_provider.infer, [_image], [_mask])
+            _psnrs.append(psnr(_result[0], _reference))
+            _latencies.append(_ms)
+        _rows.append([_name, f"{np.mean(_psnrs):.2f}", f"{np.mean(_latencies):.1f}",
+                      f"{os.path.getsize(_outputs[_name]) / 2**20:.1f}"])
+
+    write_report(f"CRFill ({len(_images)} images, {_h}x{_w})",
+                 ["Variant", "PSNR vs FP32 (dB)", "ms / image", "Size MB"], _rows, args.report)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("model", choices=["segformer", "crfill"])
+    parser.add_argument("--method", choices=["static", "dynamic"], default="static",
+                        help="SegFormer INT8 quantization method")
+    parser.add_argument("--precision", nargs="+", choices=["int8", "fp16"], default=["int8", "fp16"],
+                        help="CRFill variants to build")
+    parser.add_argument("--source", default=None,
+                        help="CRFill FP32 ONNX model with dynamic height/width, "
+                             "exported to models/crfill.onnx when omitted")
+    parser.add_argument("--size", type=int, default=512,
+                        help="CRFill calibration and evaluation H/W, multiple of 4")
+    parser.add_argument("--samples", type=int, default=32,
+                        help="Images sampled from data/uploads")
+    parser.add_argument("--calibration", type=int, default=16,
+                        help="Images used for static calibration")
+    parser.add_argument("--threshold", type=float, default=0.65)
+    parser.add_argument("--report", default=os.path.join("models", "quantization_report.md"))
+    args = parser.parse_args()
+
+    if args.model == "segformer":
+        quantize_segformer(args)
+    else:
+        quantize_crfill(args)
+
+
+if __name__ == "__main__":
+    main()
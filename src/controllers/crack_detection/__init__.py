@@ -1,19 +1,36 @@
+import os
 import time
 import logging
-import shutil
-from src.controllers.crack_detection.unet import UnetCrackSeg
-from src.controllers.crack_detection.yolo import YoloCrackSeg
+import numpy as np
 from src.controllers.crack_detection.seg_former import FormerCrackSeg
+from src.utils.registry import SharedModels
+from src.utils.result_cache import Results, array_hash, model_version, result_key
+from src.utils.static import parallel_map
+
+
+# `<model>[-variant][-tiled]`, `int8` runs the quantized model built by
+# `python -m scripts.quantize_models segformer`, `tiled` segments large
+# images at full resolution
+PROVIDERS = [f"segformer{variant}{tiled}"
+             for variant in ("", "-int8") for tiled in ("", "-tiled")]
+
+# Probability maps larger than this (full-resolution tiled maps, uint8) are
+# not cached
+CacheMaxPixels = int(float(os.environ.get("CRACKSEG_CACHE_MAX_MEGAPIXELS", 64)) * 2**20)
 
 
 class CrackSegController:
     def __init__(self, provider: str = "segformer"):
-        self.provider = provider
-        self.model = self.__get_provider(provider)
+        self.set_provider(provider)
 
     def __get_provider(self, provider: str = "segformer"):
-        if provider == "segformer":
-            return FormerCrackSeg()
+        if provider not in PROVIDERS:
+            raise ValueError(f"Provider {provider} invalid")
+
+        name, *options = provider.split("-")
+        variant = "int8" if "int8" in options else "fp32"
+        if name == "segformer":
+            return SharedModels.get(name, FormerCrackSeg, variant=variant)
         # elif provider == "yolo":
         #     return YoloCrackSeg()
         # elif provider == "unet":
@@ -21,13 +38,64 @@ class CrackSegController:
         else:
             raise ValueError(f"Provider {provider} invalid")
 
+    def __is_tiled(self, provider: str) -> bool:
+        return "tiled" in provider.split("-")[1:]
+
     def set_provider(self, provider: str):
-        self.model = self.__get_provider(provider)
+        self.__get_provider(provider)
+        self.provider = provider
 
-    def infer(self, images, threshold: float = 0.65):
+    @property
+    def model(self):
+        return self.__get_provider(self.provider)
+
+    def infer(self, images, threshold: float = 0.65, provider: str = None):
+        model = self.__get_provider(provider or self.provider)
         s = time.time()
-        crack_results = self.model.infer(images, threshold)
+        crack_results = model.infer(
+            images, threshold, tiled=self.__is_tiled(provider or self.provider))
         logging.info(
             f"Inferred {self.__class__.__name__} [{round(time.time() - s)}s]")
 
         return crack_results
+
+    def cached(self, images, provider: str = None) -> tuple[list[str], list]:
+        """
+        Cache keys of `images` and their cached probability maps, None when
+        missing. Images are hashed in parallel, and not at all when the
+        result cache is off (no keys).
+        """
+        if not Results.enabled:
+            return [], [None] * len(images)
+        provider = provider or self.provider
+        model = self.__get_provider(provider)
+        _version = result_key(provider, model_version(model.model_path))
+        _keys = parallel_map(
+            lambda image: result_key(_version, array_hash(np.asarray(image))), images)
+        return _keys, [Results.get("segformer", key) for key in _keys]
+
+    def predict(self, images, provider: str = None):
+        """
+        Crack probability maps, independent of threshold so images from
+        requests with different thresholds can share one batch
+        """
+        provider = provider or self.provider
+        model = self.__get_provider(provider)
+        s = time.time()
+        probs = model.predict(images, tiled=self.__is_tiled(provider))
+        logging.info(
+            f"Predicted {len(images)} images with {model.__class__.__name__} [{round(time.time() - s, 4)}s]")
+        return probs
+
+    def cache(self, keys: list[str], probs: list):
+        """
+        Store probability maps by their `cached` keys in one background
+        write, so a new threshold skips inference
+        """
+        Results.put_later("segformer", [
+            (key, prob) for key, prob in zip(keys, probs)
+            if prob.shape[0] * prob.shape[1] <= CacheMaxPixels])
+
+    def postprocess(self, images, probs, threshold: float = 0.65, provider: str = None):
+        model = self.__get_provider(provider or self.provider)
+        return model.postprocess(images, probs, threshold)
@@ -1,18 +1,33 @@
 import os
+import itertools
 import numpy as np
+import numpy.typing as npt
 from PIL import Image
 import math
 import cv2 as cv
 import gdown
 from src.utils.onnx_infer import onnx_interence_session, onnx_inference
+from src.utils.tiling import iter_tiles, feather_window, TileMerger
+from ._processing import SegFormerProcessor, image_size
 
 
 class FormerCrackSeg():
-    def __init__(self):
+    def __init__(self, max_batch_size: int = None, variant: str = "fp32"):
+        self.variant = variant
         self.model_path = self.__download_model()
-        self.session = onnx_interence_session(self.model_path)
+        self.session = onnx_interence_session(self.model_path, name="seg_former")
         self.input_model_shape = self.session.get_inputs()[0].shape
         self.output_model_shape = self.session.get_outputs()[0].shape
+        self.max_batch_size = max_batch_size or int(
+            os.environ.get("SEGFORMER_MAX_BATCH_SIZE", 8))
+        self.dynamic_batch = self.__has_dynamic_batch()
+        self.processor = SegFormerProcessor(self.input_model_shape)
+
+        # Tiled mode
+        self.tile_overlap = int(os.environ.get("SEGFORMER_TILE_OVERLAP", 64))
+        self.tile_merge = os.environ.get("SEGFORMER_TILE_MERGE", "feather")
+        self.tile_window = feather_window(
+            self.processor.input_h, self.processor.input_w, self.tile_overlap)
 
     def __download_model(self):
         seg_former_model_path = os.path.join(
@@ -20,48 +35,119 @@ class FormerCrackSeg():
         if not os.path.exists(seg_former_model_path):
             gdown.download(id="1K6pE3fexH25ek4OrrUbvIvqpg7YM1AXv",
                            output=seg_former_model_path)
+
+        # Quantized variants are built offline from the FP32 model
+        if self.variant != "fp32":
+            seg_former_model_path = seg_former_model_path.replace(
+                ".onnx", f".{self.variant}.onnx")
+            if not os.path.exists(seg_former_model_path):
+                raise FileNotFoundError(
+                    f"{seg_former_model_path} not found, run `python -m scripts.quantize_models segformer`")
         return seg_former_model_path
 
+    def __has_dynamic_batch(self) -> bool:
+        # Batch axis is dynamic when exported as a symbolic dim (str/None),
+        # and the output must keep that axis to scatter masks back
+        _batch_dim = self.input_model_shape[0]
+        return not isinstance(_batch_dim, int) and len(self.output_model_shape) == 4
+
     def _sigmoid(self, x):
         return 1 / (1 + math.exp(-x))
 
-    # Preprocess the image
-    def _preprocess_image(self, pil_image):
-        # Resize to the model's input shape
-        re_image = pil_image.resize(
-            (self.input_model_shape[2], self.input_model_shape[3]))
-        image_data = np.asarray(re_image).astype('float32')
-        image_data = image_data.transpose(2, 0, 1)  # HWC to CHW
-        image_data = np.expand_dims(image_data, axis=0)  # Add batch dimension
-
-        return image_data
-
-    def infer(self, images: list[Image.Image], threshold: float):
-        crack_results = []
-        threshold = threshold * 255
-
-        for image in images:
-            # print image shape
-            image_w, image_h = image.size
-            input_data = self._preprocess_image(image)
-
-            # Run inference
-            prediction = onnx_inference(self.session, input_data)
-            mask_seg_prediction = prediction[:, :, 1]
-            mask_seg = cv.resize(mask_seg_prediction,
-                                 (image_w, image_h), interpolation=cv.INTER_AREA)
-
-            # Convert to black and white image
-            crack_mask = mask_seg * 255
-            crack_mask[crack_mask < threshold] = 0
-            pred_arr_img = crack_mask.astype(np.uint8)
-
-            # Convert to PIL image
-            crack_mask_result = Image.fromarray(pred_arr_img).convert("L")
-            crack_results.append(crack_mask_result)
-
-            # Save result chart
-            # _title = f'SegFormerCrack Model; threshold = {threshold/255}'
-            # compile_result_chart(_title, image, crack_mask_result)
-
-        return crack_results
+    @property
+    def batch_size(self) -> int:
+        # Fall back to per-image calls when the exported batch axis is fixed
+        return self.max_batch_size if self.dynamic_batch else 1
+
+    def _predict_resized(self, images: list[Image.Image | npt.NDArray]) -> list[npt.NDArray[np.float32]]:
+        probs = []
+        _batch_size = self.batch_size
+        for i in range(0, len(images), _batch_size):
+            # Stack to [n, c, h, w]
+            input_data = self.processor.preprocess(images[i:i + _batch_size])
+
+            # Run inference, predictions shape [n, h, w, 2]
+            predictions = onnx_inference(self.session, input_data)
+            if predictions.ndim == 3:
+                predictions = predictions[np.newaxis]
+            probs.extend(p[:, :, 1] for p in predictions)
+
+        return probs
+
+    def _predict_tiled(self, image: Image.Image | npt.NDArray) -> npt.NDArray[np.uint8]:
+        """
+        Full-resolution probability map from overlapping model-sized tiles.
+        Tiles are generated lazily and run `batch_size` at a time, so only
+        one batch of tiles plus the merged map is held in memory.
+        """
+        _image = np.asarray(image)
+        _tile_h, _tile_w = self.processor.input_h, self.processor.input_w
+        _merger = TileMerger(*_image.shape[:2], self.tile_merge, self.tile_window)
+
+        _tiles = iter_tiles(_image, (_tile_h, _tile_w), self.tile_overlap)
+        while _batch := list(itertools.islice(_tiles, self.batch_size)):
+            input_data = self.processor.preprocess([t[2] for t in _batch])
+            predictions = onnx_inference(self.session, input_data)
+            if predictions.ndim == 3:
+                predictions = predictions[np.newaxis]
+
+            for (y, x, _, (h, w)), prediction in zip(_batch, predictions):
+                prob = cv.resize(np.ascontiguousarray(prediction[:, :, 1]),
+                                 (_tile_w, _tile_h), interpolation=cv.INTER_LINEAR)
+                _merger.add(prob[:h, :w], y, x)
+
+        # Quantize to the 0-255 mask scale, a quarter of the float32 map is
+        # held until the request thresholds it
+        _prob = _merger.result()
+        _map = np.empty(_prob.shape, np.uint8)
+        np.multiply(_prob, 255, out=_prob)
+        np.rint(_prob, out=_map, casting="unsafe")
+        return _map
+
+    def __needs_tiling(self, image: Image.Image | npt.NDArray) -> bool:
+        _w, _h = image_size(image)
+        return _h > self.processor.input_h or _w > self.processor.input_w
+
+    def predict(self, images: list[Image.Image | npt.NDArray], tiled: bool = False) -> list[npt.NDArray]:
+        """
+        Return crack probability maps, float32 at the model resolution or,
+        in tiled mode, uint8 (0-255) at full resolution for images larger
+        than the model input
+        """
+        if not tiled:
+            return self._predict_resized(images)
+
+        probs = [None] * len(images)
+        _small = []
+        for i, image in enumerate(images):
+            if self.__needs_tiling(image):
+                probs[i] = self._predict_tiled(image)
+            else:
+                _small.append(i)
+
+        # Images fitting in one tile are batched as usual
+        for i, prob in zip(_small, self._predict_resized([images[i] for i in _small])):
+            probs[i] = prob
+
+        return probs
+
+    def postprocess(
+        self,
+        images: list[Image.Image | npt.NDArray],
+        probs: list[npt.NDArray],
+        threshold: float
+    ) -> list[Image.Image]:
+        """
+        Resize probability maps back to image size and threshold them
+        """
+        return [self.processor.postprocess(prob, image_size(image), threshold)
+                for image, prob in zip(images, probs)]
+
+    def infer(self, images: list[Image.Image], threshold: float, tiled: bool = False):
+        probs = self.predict(images, tiled)
+
+        # Save result chart
+        # _title = f'SegFormerCrack Model; threshold = {threshold}'
+        # compile_result_chart(_title, image, crack_mask_result)
+
+        return self.postprocess(images, probs, threshold)
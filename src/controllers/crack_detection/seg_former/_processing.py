@@ -0,0 +1,70 @@
+import math
+import numpy as np
+import numpy.typing as npt
+import cv2 as cv
+from PIL import Image
+from src.utils.buffers import BufferPool
+
+
+def image_size(image: Image.Image | npt.NDArray) -> tuple[int, int]:
+    """Return (width, height) of a PIL image or HWC array"""
+    if isinstance(image, Image.Image):
+        return image.size
+    return image.shape[1], image.shape[0]
+
+
+class SegFormerProcessor:
+    """
+    Pre/post-processing stage of SegFormer working on reused buffers.
+
+    Preprocessing resizes straight into a uint8 buffer and casts it into the
+    [n, c, h, w] float32 batch in one pass. Postprocessing resizes the
+    probability map into a reused full-resolution buffer, thresholds it in
+    place and writes the uint8 mask in a single cast. Full-resolution maps
+    of tiled mode arrive as uint8 on the 0-255 mask scale and are resized
+    and thresholded without a float copy.
+    """
+
+    def __init__(self, input_shape: list):
+        # Model input is [n, c, h, w]
+        self.input_h, self.input_w = input_shape[2], input_shape[3]
+        self.pool = BufferPool()
+
+    def preprocess(self, images: list[Image.Image | npt.NDArray]) -> npt.NDArray[np.float32]:
+        _batch = self.pool.get(
+            "batch", (len(images), 3, self.input_h, self.input_w), np.float32)
+        _resized = self.pool.get(
+            "resized", (self.input_h, self.input_w, 3), np.uint8)
+
+        for i, image in enumerate(images):
+            cv.resize(np.asarray(image), (self.input_w, self.input_h),
+                      dst=_resized, interpolation=cv.INTER_AREA)
+            _batch[i] = _resized.transpose(2, 0, 1)  # HWC uint8 to CHW float32
+
+        return _batch
+
+    def postprocess(
+        self,
+        prob: npt.NDArray,
+        size: tuple[int, int],
+        threshold: float
+    ) -> Image.Image:
+        _w, _h = size
+        if prob.dtype == np.uint8:
+            _mask = np.empty((_h, _w), dtype=np.uint8)
+            cv.resize(np.ascontiguousarray(prob), (_w, _h),
+                      dst=_mask, interpolation=cv.INTER_AREA)
+            # Keep values >= threshold * 255
+            cv.threshold(_mask, math.ceil(threshold * 255) - 1, 0, cv.THRESH_TOZERO, dst=_mask)
+            return Image.fromarray(_mask)
+
+        _full = self.pool.get("prob", (_h, _w), np.float32)
+        cv.resize(np.ascontiguousarray(prob), (_w, _h),
+                  dst=_full, interpolation=cv.INTER_AREA)
+
+        # Zero everything under threshold, then scale and cast in one pass
+        cv.threshold(_full, threshold, 0, cv.THRESH_TOZERO, dst=_full)
+        _mask = np.empty((_h, _w), dtype=np.uint8)
+        np.multiply(_full, 255, out=_mask, casting="unsafe")
+
+        return Image.fromarray(_mask)
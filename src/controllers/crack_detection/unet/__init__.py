@@ -7,6 +7,7 @@ import torch.nn.functional as F
 from torch.autograd import Variable
 import torchvision.transforms as transforms
 from src.controllers.crack_detection.unet.unet_transfer import UNet16, input_size
+from src.utils.torch_infer import TorchCompileMode, ScriptedModel
 import matplotlib.pyplot as plt
 from os.path import join
 from PIL import Image
@@ -30,6 +31,7 @@ class UnetCrackSeg():
         self.crack_viz_results = "data/crack_results/crack_viz_results"
         self.device = torch.device(
             "cuda" if torch.cuda.is_available() else "cpu")
+        self.model = None
 
         self.train_tfms = transforms.Compose([transforms.ToTensor(
         ), transforms.Normalize(self.channel_means, self.channel_stds)])
@@ -54,6 +56,31 @@ class UnetCrackSeg():
         mask = cv.resize(mask, (img_width, img_height), cv.INTER_AREA)
         return mask
 
+    def load_model(self):
+        """
+        Load the model once, as warmed-up TorchScript when `TORCH_COMPILE=script`
+        """
+        if self.model is not None:
+            return self.model
+
+        if self.model_type == 'vgg16':
+            model = load_unet_vgg16(self.model_path)
+        elif self.model_type == 'resnet101':
+            model = load_unet_resnet_101(self.model_path)
+        elif self.model_type == 'resnet34':
+            model = load_unet_resnet_34(self.model_path)
+        else:
+            raise ValueError(f"Model {self.model_type} is invalid!")
+
+        if TorchCompileMode == "script":
+            # Inputs are always resized to `input_size`
+            model = ScriptedModel(model, f"unet_{self.model_type}", self.model_path)
+            model.warmup(lambda b, h, w: (torch.zeros(b, 3, h, w),),
+                         [(1, input_size[1], input_size[0])])
+
+        self.model = model
+        return model
+
     def infer(self, img_folder, save_results=True):
         img_dir = f"tmp/upload_files/{img_folder}"
         seg_results = []
@@ -72,14 +99,7 @@ class UnetCrackSeg():
                 shutil.rmtree(str(path))
             os.makedirs(self.out_pred_dir, exist_ok=True)
 
-        if self.model_type == 'vgg16':
-            model = load_unet_vgg16(self.model_path)
-        elif self.model_type == 'resnet101':
-            model = load_unet_resnet_101(self.model_path)
-        elif self.model_type == 'resnet34':
-            model = load_unet_resnet_34(self.model_path)
-        else:
-            raise ValueError(f"Model {self.model_type} is invalid!")
+        model = self.load_model()
 
         paths = [path for path in Path(img_dir).glob('*.*')]
         raw_arr_imgs = []
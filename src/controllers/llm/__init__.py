@@ -1,12 +1,19 @@
 from pydantic import BaseModel, Field
+import os
 import enum
 import time
+import asyncio
 import logging
-from langchain_core.messages import AIMessage, HumanMessage, AIMessageChunk
+from typing import AsyncIterator
+from concurrent.futures import ThreadPoolExecutor
+from langchain_core.messages import BaseMessage
 from langchain_core.runnables import Runnable
-from ._prompt import prompt_template
+from ._memory import Conversation, ConversationStore, Turn, count_tokens
+from ._cache import ResponseCache, CachedAnswer
+from ._retrieval import KnowledgeRetriever
 from .gemini import gemini
 from .gpt import gpt
+from src.utils.metrics import Metrics
 
 
 PROVIDERS = {
@@ -14,6 +21,36 @@ PROVIDERS = {
     "gpt": gpt
 }
 
+# Seconds to wait for each provider of a fan-out
+ProviderTimeout = float(os.environ.get("LLM_PROVIDER_TIMEOUT", 30))
+# Conversation window of each client, in estimated tokens
+MemoryTokens = int(os.environ.get("LLM_MEMORY_TOKENS", 2048))
+# Evict conversations idle for this many seconds
+MemoryIdleSeconds = float(os.environ.get("LLM_MEMORY_IDLE_SECONDS", 1800))
+MemoryMaxSessions = int(os.environ.get("LLM_MEMORY_MAX_SESSIONS", 1000))
+# Summarize turns leaving the window instead of dropping them
+MemorySummarize = os.environ.get("LLM_MEMORY_SUMMARIZE", "0").lower() in ("1", "true")
+# Answers cache, exact questions only by default. A similarity in (0, 1]
+# also serves near-identical questions (typos), never ones whose numbers,
+# words or word order differ
+CacheEnabled = os.environ.get("LLM_CACHE", "1").lower() in ("1", "true")
+CacheTTLSeconds = float(os.environ.get("LLM_CACHE_TTL_SECONDS", 86400))
+CacheMaxEntries = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+CacheSimilarity = float(os.environ.get("LLM_CACHE_SIMILARITY", 0))
+# Send the top-k knowledge chunks relevant to each question, not the
+# whole knowledge
+RetrievalEnabled = os.environ.get("LLM_RETRIEVAL", "1").lower() in ("1", "true")
+RetrievalTopK = int(os.environ.get("LLM_RETRIEVAL_TOP_K", 3))
+RetrievalChunkTokens = int(os.environ.get("LLM_RETRIEVAL_CHUNK_TOKENS", 60))
+# Chunks kept selected over a conversation, and the BM25 score below which a
+# follow-up question keeps the previous selection only
+RetrievalMaxChunks = int(os.environ.get("LLM_RETRIEVAL_MAX_CHUNKS", 6))
+RetrievalMinScore = float(os.environ.get("LLM_RETRIEVAL_MIN_SCORE", 3.0))
+
+
+def prompt_tokens(messages: list[BaseMessage]) -> int:
+    return sum(count_tokens(_message.content) for _message in messages)
+
 
 class LLMProvider(enum.Enum):
     gemini = "gemini"
@@ -25,16 +62,28 @@ class LLMInputs(BaseModel):
     question: str = Field(..., description="Question to be answered")
     knowledge: str = Field(None, description="Knowledge to be used")
     use_stream: bool = Field(False, description="Use stream response or not")
+    stream_format: str = Field(
+        "text", description="Stream as plain `text` or server-sent events `sse`")
     provider: LLMProvider = Field(
         LLMProvider.gemini, description="LLM provider")
+    first_answer: bool = Field(
+        False, description="With provider `all`, return the first answer only")
 
 
 class LLMController:
     def __init__(self):
-        self.model = self.__get_provider(LLMProvider.gemini)
-        self.history = [
-            AIMessage(prompt_template)
-        ]
+        self.provider = LLMProvider.gemini
+        self.model = self.__get_provider(self.provider)
+        self.cache = ResponseCache(
+            CacheMaxEntries, CacheTTLSeconds, threshold=CacheSimilarity, enabled=CacheEnabled)
+        self.retriever = KnowledgeRetriever(
+            RetrievalTopK, RetrievalChunkTokens, RetrievalMaxChunks, RetrievalMinScore,
+            enabled=RetrievalEnabled)
+        self.sessions = ConversationStore(
+            MemoryTokens, MemoryIdleSeconds, MemoryMaxSessions, summarize=MemorySummarize)
+        self._background: set[asyncio.Task] = set()
+        # Summaries of the blocking `generate` path
+        self._summarizer = ThreadPoolExecutor(max_workers=2, thread_name_prefix="llm-summary")
 
     def __get_provider(self, provider: LLMProvider) -> Runnable:
         global PROVIDERS
@@ -45,72 +94,230 @@ class LLMController:
 
     def set_provider(self, provider: LLMProvider):
         self.model = self.__get_provider(provider)
+        self.provider = provider
 
-    def __add_question(self, question: str, knowledge: str = None):
-        if knowledge:
-            self.history.append(AIMessage(
-                f"The provided knowledge about question is: {knowledge}"))
-        self.history.append(HumanMessage(question))
+    def __ask(self, client_id: str, question: str, knowledge: str = None, cached: bool = False):
+        """
+        Add the question to the client's conversation, return the
+        conversation, the turn to answer and the messages to send
+        """
+        _session = self.sessions.get(client_id)
+        _knowledge, _chunks = self.retriever.select(
+            question, knowledge, _session.selected_chunks(knowledge))
+        _turn, _messages = _session.ask(question, _knowledge, source=knowledge, chunks=_chunks)
+        if not cached:
+            Metrics.observe("llm.prompt_tokens", prompt_tokens(_messages))
+        return _session, _turn, _messages
 
-    def __add_answer(self, answer: AIMessage):
-        self.history.append(answer)
+    def __cacheable(self, client_id: str) -> bool:
+        # Answers depend on the conversation so far, only opening questions
+        # are shared between clients through the cache
+        return self.sessions.get(client_id).is_new()
 
-    def __add_answer_chunk(self, chunk: AIMessageChunk):
-        last_message = self.history[-1]
-        if isinstance(last_message, AIMessageChunk):
-            last_message.content = chunk.content
-        else:
-            self.history.append(chunk)
+    def __summarize(self, session: Conversation, model: Runnable):
+        _request = session.summary_request()
+        if _request is not None:
+            try:
+                session.fold(model.invoke(_request).content)
+            except Exception:
+                Metrics.increment("llm.summary.error")
+                logging.exception("Failed to summarize the conversation")
+
+    async def __asummarize(self, session: Conversation, model: Runnable):
+        _request = session.summary_request()
+        if _request is not None:
+            try:
+                session.fold((await model.ainvoke(_request)).content)
+            except Exception:
+                Metrics.increment("llm.summary.error")
+                logging.exception("Failed to summarize the conversation")
 
-    def generate(self, prompt: str, knowledge: str):
-        # Add the question to the history
-        self.__add_question(prompt, knowledge)
+    def __summarize_later(self, session: Conversation, model: Runnable):
+        # Off the response path, the next question waits for nothing
+        if session.dropped:
+            _task = asyncio.ensure_future(self.__asummarize(session, model))
+            self._background.add(_task)
+            _task.add_done_callback(self.__release_background)
+
+    def generate(self, prompt: str, knowledge: str, provider: LLMProvider = None, client_id: str = "default"):
+        provider = provider or self.provider
+        model = self.__get_provider(provider)
+
+        # Answer from the cache when the question was already asked
+        _cacheable = self.__cacheable(client_id)
+        _cached = self.cache.get(provider.value, prompt, knowledge) if _cacheable else None
+        if _cached is not None:
+            _session, _turn, _ = self.__ask(client_id, prompt, knowledge, cached=True)
+            _session.answer(_turn, _cached.answer)
+            return _cached.answer
+
+        # Add the question to the conversation
+        _session, _turn, _messages = self.__ask(client_id, prompt, knowledge)
 
         print("Prompt:", prompt)
         print("Knowledge:", knowledge)
 
         # Generate the answer
         _s = time.time()
-        answer = self.model.invoke(self.history)
+        answer = model.invoke(_messages)
         logging.info(
             f"Generated answer successfull [{round(time.time() - _s, 2)}s]")
 
-        # Add the answer to the history
-        self.__add_answer(answer)
+        # Add the answer to the conversation
+        _session.answer(_turn, answer.content)
+        if _cacheable:
+            self.cache.put(provider.value, prompt, knowledge, answer.content)
+        # Off the response path, like `__summarize_later` on the event loop
+        if _session.dropped:
+            self._summarizer.submit(self.__summarize, _session, model)
         return answer.content
 
-    def generate_async(self, prompt: str, knowledge: str):
-        # Add the question to the history
-        self.__add_question(prompt, knowledge)
+    def astream(
+        self,
+        prompt: str,
+        knowledge: str,
+        provider: LLMProvider = None,
+        client_id: str = "default",
+    ) -> AsyncIterator[str]:
+        """
+        Stream answer pieces from the provider's `astream` on the event loop.
+        Closing the iterator (e.g. on client disconnect) cancels the
+        provider call; the partial answer is kept in the conversation.
+        Cached answers are replayed chunk by chunk.
+        """
+        # Resolve the provider now, an unknown one fails before streaming
+        provider = provider or LLMProvider.gemini
+        model = self.__get_provider(provider)
 
-        # Generate the answer
-        _s = time.time()
-        streamer = self.model.stream(self.history)
-        logging.info(
-            f"Generated answer successfull [{round(time.time() - _s, 2)}s]")
+        _cacheable = self.__cacheable(client_id)
+        _cached = self.cache.get(provider.value, prompt, knowledge) if _cacheable else None
+        if _cached is not None:
+            _session, _turn, _ = self.__ask(client_id, prompt, knowledge, cached=True)
+            return self.__replay(_cached, _session, _turn)
 
-        # Generate the answer
-        for chunk in streamer:
-            self.__add_answer_chunk(chunk)
-            yield chunk.content
-
-    def generate_choices(self, prompt: str, knowledge: str):
-        # Add the question to the history
-        self.__add_question(prompt, knowledge)
-
-        # Iterate over provided
-        answers = []
-        for name, provider in PROVIDERS.items():
-            self.set_provider(provider)
-            # Generate the answer
-            _s = time.time()
-            answer = self.model.invoke(self.history)
+        # Add the question to the conversation
+        _session, _turn, _messages = self.__ask(client_id, prompt, knowledge)
+        return self.__astream(
+            provider.value, model, _session, _turn, _messages, prompt, knowledge, _cacheable)
+
+    async def __replay(self, cached: CachedAnswer, session: Conversation, turn: Turn) -> AsyncIterator[str]:
+        session.answer(turn, cached.answer)
+        for _chunk in cached.chunks:
+            yield _chunk
+
+    async def __astream(
+        self,
+        name: str,
+        model: Runnable,
+        session: Conversation,
+        turn: Turn,
+        messages: list[BaseMessage],
+        question: str,
+        knowledge: str,
+        cacheable: bool,
+    ) -> AsyncIterator[str]:
+        _s = time.perf_counter()
+        _first, _complete = None, False
+        _pieces, _chunks, _usage_tokens = [], 0, 0
+        _stream = model.astream(messages)
+        try:
+            async for chunk in _stream:
+                if _first is None:
+                    _first = time.perf_counter()
+                    Metrics.observe(f"llm.{name}.ttft_ms", (_first - _s) * 1000)
+                _chunks += 1
+                _usage = getattr(chunk, "usage_metadata", None)
+                if _usage:
+                    _usage_tokens += _usage.get("output_tokens", 0)
+                _pieces.append(chunk.content)
+                yield chunk.content
+            _complete = True
+        except (asyncio.CancelledError, GeneratorExit):
+            Metrics.increment(f"llm.{name}.cancelled")
+            raise
+        finally:
+            await _stream.aclose()
+            _end = time.perf_counter()
+            # Providers without usage metadata count one token a chunk
+            _tokens = _usage_tokens or _chunks
+            if _first is not None and _end > _first:
+                Metrics.observe(f"llm.{name}.tokens_per_s", _tokens / (_end - _first))
             logging.info(
-                f"Generated {name} answer successfull [{round(time.time() - _s, 2)}s]")
+                f"Streamed {name} answer, {_tokens} tokens [{round(_end - _s, 2)}s]")
+            session.answer(turn, "".join(_pieces))
+            # Only complete answers to opening questions are cached
+            if _complete and cacheable:
+                self.cache.put(name, question, knowledge, "".join(_pieces), _pieces)
+            self.__summarize_later(session, model)
+
+    def __release_background(self, task: asyncio.Task):
+        self._background.discard(task)
+        if not task.cancelled():
+            # Retrieve the error, it is already counted in metrics
+            task.exception()
+
+    async def __ainvoke(self, name: str, model: Runnable, messages: list, timeout: float):
+        _s = time.perf_counter()
+        try:
+            answer = await asyncio.wait_for(model.ainvoke(messages), timeout)
+        except asyncio.TimeoutError:
+            Metrics.increment(f"llm.{name}.timeout")
+            raise
+        except Exception:
+            Metrics.increment(f"llm.{name}.error")
+            raise
+        finally:
+            _latency = (time.perf_counter() - _s) * 1000
+            Metrics.observe(f"llm.{name}.latency_ms", _latency)
+        logging.info(
+            f"Generated {name} answer successfull [{round(_latency / 1000, 2)}s]")
+        return answer, _latency
+
+    async def agenerate_choices(
+        self,
+        prompt: str,
+        knowledge: str,
+        timeout: float = ProviderTimeout,
+        first: bool = False,
+        client_id: str = "default",
+    ) -> dict:
+        """
+        Ask every provider concurrently, wall time is the slowest provider
+        (bounded by `timeout`) instead of the sum. Providers failing or timing
+        out are reported in `errors`. With `first`, return as soon as one
+        provider answers; the others keep running to record their latency.
+        """
+        _session, _turn, _messages = self.__ask(client_id, prompt, knowledge)
+        _tasks = {asyncio.ensure_future(self.__ainvoke(name, model, _messages, timeout)): name
+                  for name, model in PROVIDERS.items()}
+
+        results, errors = {}, {}
+        _pending = set(_tasks)
+        while _pending:
+            _done, _pending = await asyncio.wait(_pending, return_when=asyncio.FIRST_COMPLETED)
+            for _task in _done:
+                _name = _tasks[_task]
+                if _task.exception() is not None:
+                    errors[_name] = repr(_task.exception())
+                else:
+                    results[_name] = _task.result()
+            if first and results:
+                break
 
-            # Add the answer to the history
-            answers.append(answer)
+        # Keep providers still running alive until they finish
+        for _task in _pending:
+            self._background.add(_task)
+            _task.add_done_callback(self.__release_background)
 
-        for answer in answers:
-            self.__add_answer(answer)
-        return [a.content for a in answers]
+        # Answers in provider order
+        answers = [results[name][0] for name in PROVIDERS if name in results]
+        # The first answer continues the conversation
+        if answers:
+            _session.answer(_turn, answers[0].content)
+            self.__summarize_later(_session, self.model)
+        return {
+            "answer": [a.content for a in answers],
+            "providers": [name for name in PROVIDERS if name in results],
+            "latency_ms": {name: round(r[1], 1) for name, r in results.items()},
+            "errors": errors,
+        }
@@ -0,0 +1,209 @@
+"""
+Cache of LLM answers by provider, question and knowledge
+"""
+import re
+import time
+import zlib
+import threading
+import unicodedata
+from dataclasses import dataclass, field
+from collections import OrderedDict
+import numpy as np
+import numpy.typing as npt
+from src.utils.metrics import Metrics
+from ._memory import knowledge_hash
+
+
+PunctuationPattern = re.compile(r"[^\w\s]")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Case, punctuation and spacing insensitive form of a question
+    """
+    _question = unicodedata.normalize("NFC", question).lower()
+    return " ".join(PunctuationPattern.sub(" ", _question).split())
+
+
+def edit_distance(a: str, b: str) -> int:
+    _previous = list(range(len(b) + 1))
+    for i, _a in enumerate(a, 1):
+        _current = [i]
+        for j, _b in enumerate(b, 1):
+            _current.append(min(
+                _previous[j] + 1, _current[j - 1] + 1, _previous[j - 1] + (_a != _b)))
+        _previous = _current
+    return _previous[-1]
+
+
+def same_question(a: str, b: str, min_typo_length: int = 4) -> bool:
+    """
+    Whether two normalized questions only differ by typos: the same words in
+    the same order, each pair equal or one edit apart when both are at least
+    `min_typo_length` long and have no digit. Tells apart questions a
+    trigram similarity scores above 0.9, e.g. "thời nhà Lý" / "thời nhà Lê",
+    "tầng 1" / "tầng 2" or swapped words.
+    """
+    _a, _b = a.split(), b.split()
+    if len(_a) != len(_b):
+        return False
+    for _x, _y in zip(_a, _b):
+        if _x == _y:
+            continue
+        if any(_c.isdigit() for _c in _x + _y):
+            return False
+        if min(len(_x), len(_y)) < min_typo_length or edit_distance(_x, _y) > 1:
+            return False
+    return True
+
+
+class HashingEmbedder:
+    """
+    Bag of character trigrams hashed into `dim` signed buckets, L2
+    normalized. Needs no model and catches rewordings, typos and word
+    order changes of the same question.
+    """
+
+    def __init__(self, dim: int = 1024):
+        self.dim = dim
+
+    def __call__(self, text: str) -> npt.NDArray[np.float32]:
+        _text = f" {text} "
+        _hashes = np.array(
+            [zlib.crc32(_text[i:i + 3].encode()) for i in range(max(1, len(_text) - 2))],
+            dtype=np.uint32)
+        _signs = np.where(_hashes & 1 << 31, -1.0, 1.0)
+        _vector = np.bincount(_hashes % self.dim, weights=_signs, minlength=self.dim)
+        _norm = np.linalg.norm(_vector)
+        return (_vector / _norm if _norm else _vector).astype(np.float32)
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    chunks: list[str]
+    created: float = field(default_factory=time.monotonic)
+
+
+class FlatIndex:
+    """
+    Exact cosine search over the unit vectors of one provider and knowledge
+    """
+
+    def __init__(self, dim: int):
+        self.keys: list[str] = []
+        self.vectors = np.empty((0, dim), np.float32)
+
+    def add(self, key: str, vector: npt.NDArray[np.float32]):
+        self.keys.append(key)
+        self.vectors = np.vstack([self.vectors, vector])
+
+    def remove(self, key: str):
+        _index = self.keys.index(key)
+        del self.keys[_index]
+        self.vectors = np.delete(self.vectors, _index, axis=0)
+
+    def search(self, vector: npt.NDArray[np.float32]) -> tuple[str, float] | None:
+        if not self.keys:
+            return None
+        _scores = self.vectors @ vector
+        _best = int(np.argmax(_scores))
+        return self.keys[_best], float(_scores[_best])
+
+
+class ResponseCache:
+    """
+    LRU cache of answers expiring after `ttl` seconds.
+
+    Exact hits match the provider, the normalized question and the knowledge
+    hash. With a `threshold` in (0, 1], a miss falls back to the most similar
+    cached question of the same provider and knowledge, accepted when their
+    cosine similarity reaches `threshold` and `same_question` confirms it
+    only differs by typos. Off by default.
+
+    Lookups are counted as `llm_cache.hit|semantic_hit|miss` metrics.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float = 0, enabled: bool = True):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.threshold = threshold
+        self.enabled = enabled
+        self.embedder = HashingEmbedder()
+        self._entries: OrderedDict[str, CachedAnswer] = OrderedDict()
+        self._scopes: dict[str, str] = {}
+        self._indexes: dict[str, FlatIndex] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def __scope(provider: str, knowledge: str) -> str:
+        return f"{provider}|{knowledge_hash(knowledge or '')}"
+
+    def __remove(self, key: str):
+        self._entries.pop(key)
+        _scope = self._scopes.pop(key)
+        if self.threshold > 0:
+            self._indexes[_scope].remove(key)
+            if not self._indexes[_scope].keys:
+                del self._indexes[_scope]
+
+    def __lookup(self, key: str) -> CachedAnswer | None:
+        _entry = self._entries.get(key)
+        if _entry is not None and time.monotonic() - _entry.created > self.ttl:
+            self.__remove(key)
+            return None
+        if _entry is not None:
+            self._entries.move_to_end(key)
+        return _entry
+
+    def get(self, provider: str, question: str, knowledge: str = None) -> CachedAnswer | None:
+        if not self.enabled:
+            return None
+        _scope = self.__scope(provider, knowledge)
+        _question = normalize_question(question)
+        _vector = self.embedder(_question) if self.threshold > 0 else None
+
+        with self._lock:
+            _entry = self.__lookup(f"{_scope}|{_question}")
+            _kind = "hit"
+            if _entry is None and _scope in self._indexes:
+                _match = self._indexes[_scope].search(_vector)
+                if (_match is not None and _match[1] >= self.threshold
+                        and same_question(_question, _match[0].split("|", 2)[2])):
+                    _entry = self.__lookup(_match[0])
+                    _kind = "semantic_hit"
+        Metrics.increment(f"llm_cache.{_kind if _entry is not None else 'miss'}")
+        return _entry
+
+    def put(self, provider: str, question: str, knowledge: str, answer: str, chunks: list[str] = None):
+        if not self.enabled or not answer:
+            return
+        _scope = self.__scope(provider, knowledge)
+        _question = normalize_question(question)
+        _key = f"{_scope}|{_question}"
+        _vector = self.embedder(_question) if self.threshold > 0 else None
+
+        with self._lock:
+            if _key in self._entries:
+                self.__remove(_key)
+            self._entries[_key] = CachedAnswer(answer, chunks or [answer])
+            self._scopes[_key] = _scope
+            if self.threshold > 0:
+                self._indexes.setdefault(_scope, FlatIndex(self.embedder.dim)).add(_key, _vector)
+            while len(self._entries) > self.max_entries:
+                self.__remove(next(iter(self._entries)))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._scopes.clear()
+            self._indexes.clear()
+
+    def snapshot(self) -> dict:
+        _counters = Metrics.snapshot()["counters"]
+        _hits = _counters.get("llm_cache.hit", 0) + _counters.get("llm_cache.semantic_hit", 0)
+        _lookups = _hits + _counters.get("llm_cache.miss", 0)
+        return {
+            "entries": len(self._entries),
+            "hit_rate": round(_hits / _lookups, 4) if _lookups else None,
+        }
@@ -0,0 +1,193 @@
+"""
+Per-client conversation memory with a bounded prompt
+"""
+import re
+import time
+import hashlib
+import threading
+from dataclasses import dataclass
+from collections import OrderedDict
+from langchain_core.messages import AIMessage, HumanMessage, BaseMessage
+from ._prompt import prompt_template, summary_template
+
+
+TokenPattern = re.compile(r"\w+|[^\w\s]")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Cheap token estimate, one per word or punctuation mark
+    """
+    return len(TokenPattern.findall(text or ""))
+
+
+def knowledge_hash(knowledge: str) -> str:
+    return hashlib.blake2b(knowledge.encode(), digest_size=16).hexdigest()
+
+
+@dataclass
+class Turn:
+    question: str
+    answer: str = ""
+    tokens: int = 0
+
+    def messages(self) -> list[BaseMessage]:
+        _messages = [HumanMessage(self.question)]
+        if self.answer:
+            _messages.append(AIMessage(self.answer))
+        return _messages
+
+
+class Conversation:
+    """
+    One client's conversation: the latest knowledge block (stored once,
+    however often it is sent again), a summary of older turns and the
+    newest turns fitting `budget` tokens. When the knowledge block is a
+    selection of chunks, the selection is kept with the hash of its source
+    so follow-up questions can extend it.
+
+    Turns falling out of the window are queued for summarization when
+    `summarize` is set, dropped otherwise.
+    """
+
+    def __init__(self, budget: int, summarize: bool = False):
+        self.budget = budget
+        self.summarize = summarize
+        self.knowledge: str = None
+        self.knowledge_hash: str = None
+        self.source_hash: str = None
+        self.chunks: list[int] = []
+        self.summary = ""
+        self.turns: list[Turn] = []
+        self.dropped: list[Turn] = []
+        self.last_seen = time.monotonic()
+        self._lock = threading.Lock()
+
+    def __trim(self):
+        # Newest turns first, the current question is always kept
+        _budget = self.budget - count_tokens(self.summary)
+        _keep = 1
+        _used = self.turns[-1].tokens
+        for _turn in reversed(self.turns[:-1]):
+            if _used + _turn.tokens > _budget:
+                break
+            _used += _turn.tokens
+            _keep += 1
+        _dropped = self.turns[:-_keep]
+        self.turns = self.turns[-_keep:]
+        if self.summarize:
+            self.dropped.extend(_dropped)
+
+    def is_new(self) -> bool:
+        """
+        No question asked yet, answers do not depend on earlier turns
+        """
+        with self._lock:
+            return not self.turns and not self.summary
+
+    def selected_chunks(self, source: str) -> list[int]:
+        """
+        Chunks selected earlier from the `source` knowledge
+        """
+        if not source:
+            return []
+        _hash = knowledge_hash(source)
+        with self._lock:
+            return list(self.chunks) if _hash == self.source_hash else []
+
+    def ask(
+        self,
+        question: str,
+        knowledge: str = None,
+        source: str = None,
+        chunks: list[int] = (),
+    ) -> tuple[Turn, list[BaseMessage]]:
+        """
+        Add a question, return its turn and the messages to send.
+        `knowledge` holds the `chunks` selected from `source`, if any.
+        """
+        _source_hash = knowledge_hash(source) if source and chunks else None
+        with self._lock:
+            self.last_seen = time.monotonic()
+            if knowledge:
+                _hash = knowledge_hash(knowledge)
+                if _hash != self.knowledge_hash:
+                    self.knowledge, self.knowledge_hash = knowledge, _hash
+                self.source_hash, self.chunks = _source_hash, list(chunks)
+            _turn = Turn(question, tokens=count_tokens(question))
+            self.turns.append(_turn)
+            self.__trim()
+            return _turn, self.messages()
+
+    def answer(self, turn: Turn, answer: str):
+        with self._lock:
+            self.last_seen = time.monotonic()
+            turn.answer = answer
+            turn.tokens += count_tokens(answer)
+
+    def messages(self) -> list[BaseMessage]:
+        _messages = [AIMessage(prompt_template)]
+        if self.summary:
+            _messages.append(AIMessage(
+                f"Summary of the earlier conversation: {self.summary}"))
+        if self.knowledge:
+            _messages.append(AIMessage(
+                f"The provided knowledge about question is: {self.knowledge}"))
+        for _turn in self.turns:
+            _messages.extend(_turn.messages())
+        return _messages
+
+    def summary_request(self) -> list[BaseMessage] | None:
+        """
+        Messages asking to fold the dropped turns into the summary, None
+        when there is nothing to fold
+        """
+        with self._lock:
+            if not self.dropped:
+                return None
+            _dropped, self.dropped = self.dropped, []
+        _transcript = "\n".join(
+            f"Human: {_turn.question}\nAI: {_turn.answer}" for _turn in _dropped)
+        return [HumanMessage(summary_template.format(
+            summary=self.summary or "(none)", transcript=_transcript))]
+
+    def fold(self, summary: str):
+        with self._lock:
+            self.summary = summary.strip()
+
+
+class ConversationStore:
+    """
+    Conversations by client id. Sessions idle for more than `idle_seconds`
+    are evicted, as are the least recently used ones beyond `max_sessions`.
+    """
+
+    def __init__(self, budget: int, idle_seconds: float, max_sessions: int, summarize: bool = False):
+        self.budget = budget
+        self.idle_seconds = idle_seconds
+        self.max_sessions = max_sessions
+        self.summarize = summarize
+        self._sessions: OrderedDict[str, Conversation] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __evict(self):
+        _deadline = time.monotonic() - self.idle_seconds
+        while self._sessions:
+            _oldest = next(iter(self._sessions.values()))
+            if _oldest.last_seen >= _deadline and len(self._sessions) <= self.max_sessions:
+                break
+            self._sessions.popitem(last=False)
+
+    def get(self, client_id: str) -> Conversation:
+        with self._lock:
+            _session = self._sessions.pop(client_id, None)
+            if _session is None:
+                _session = Conversation(self.budget, self.summarize)
+            # Touch before evicting, the requested session is never evicted
+            _session.last_seen = time.monotonic()
+            self._sessions[client_id] = _session
+            self.__evict()
+            return _session
+
+    def __len__(self) -> int:
+        return len(self._sessions)
@@ -7,3 +7,13 @@ Do not use icons, emojis, or any other symbols.
 Only return the answer, not repeat the question, or any other information.
 Must be answer properly and correctly.
 """
+
+summary_template = """Summarize the conversation between a tour guide and a visitor below.
+Keep the exhibits, facts and questions the visitor cares about, in a few sentences, in Vietnamese.
+Only return the summary.
+
+Previous summary: {summary}
+
+Conversation:
+{transcript}
+"""
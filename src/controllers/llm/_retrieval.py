@@ -0,0 +1,145 @@
+"""
+BM25 retrieval of the knowledge chunks relevant to a question
+"""
+import re
+import math
+import threading
+from collections import Counter, OrderedDict
+from ._memory import count_tokens, knowledge_hash
+
+
+WordPattern = re.compile(r"\w+")
+SentencePattern = re.compile(r"(?<=[.!?…])\s+")
+ParagraphPattern = re.compile(r"\n\s*")
+
+
+def terms(text: str) -> list[str]:
+    """
+    Words and pairs of adjacent words, most Vietnamese words being two
+    syllables
+    """
+    _words = WordPattern.findall(text.lower())
+    return _words + [f"{a} {b}" for a, b in zip(_words, _words[1:])]
+
+
+def split_chunks(knowledge: str, max_tokens: int = 60) -> list[str]:
+    """
+    Consecutive sentences of a paragraph grouped into chunks of about
+    `max_tokens`, a longer sentence is a chunk of its own
+    """
+    _chunks = []
+    for _paragraph in ParagraphPattern.split(knowledge):
+        _chunk, _size = [], 0
+        for _sentence in SentencePattern.split(_paragraph.strip()):
+            if not _sentence:
+                continue
+            _tokens = count_tokens(_sentence)
+            if _chunk and _size + _tokens > max_tokens:
+                _chunks.append(" ".join(_chunk))
+                _chunk, _size = [], 0
+            _chunk.append(_sentence)
+            _size += _tokens
+        if _chunk:
+            _chunks.append(" ".join(_chunk))
+    return _chunks
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a fixed list of chunks
+    """
+
+    def __init__(self, chunks: list[str], k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks
+        self.k1, self.b = k1, b
+        self.frequencies = [Counter(terms(_chunk)) for _chunk in chunks]
+        self.lengths = [sum(_f.values()) for _f in self.frequencies]
+        self.average_length = sum(self.lengths) / max(1, len(chunks))
+        _documents = Counter(_word for _f in self.frequencies for _word in _f)
+        self.idf = {
+            _word: math.log(1 + (len(chunks) - _n + 0.5) / (_n + 0.5))
+            for _word, _n in _documents.items()
+        }
+
+    def scores(self, query: str) -> list[float]:
+        _terms = [_word for _word in set(terms(query)) if _word in self.idf]
+        _scores = []
+        for _f, _length in zip(self.frequencies, self.lengths):
+            _norm = self.k1 * (1 - self.b + self.b * _length / (self.average_length or 1))
+            _scores.append(sum(
+                self.idf[_t] * _f[_t] * (self.k1 + 1) / (_f[_t] + _norm)
+                for _t in _terms if _t in _f))
+        return _scores
+
+    def top(self, query: str, k: int, min_score: float = 0) -> list[int]:
+        """
+        Indices of the `k` best chunks in knowledge order, none when the best
+        score is below `min_score` or nothing matches (e.g. a follow-up
+        question)
+        """
+        _scores = self.scores(query)
+        if not any(_scores) or max(_scores) < min_score:
+            return []
+        _best = sorted(range(len(_scores)), key=lambda i: -_scores[i])[:k]
+        return sorted(i for i in _best if _scores[i] > 0)
+
+
+class KnowledgeRetriever:
+    """
+    Inject the `top_k` chunks of the knowledge relevant to each question
+    instead of the whole text. Indexes are built once per knowledge hash and
+    the `max_indexes` most recently used are kept.
+
+    Follow-up questions keep their grounding: the chunks selected earlier in
+    the conversation stay selected (the `max_chunks` most recent), and a
+    best score below `min_score` adds nothing new.
+    """
+
+    def __init__(
+        self,
+        top_k: int = 3,
+        chunk_tokens: int = 60,
+        max_chunks: int = 6,
+        min_score: float = 3.0,
+        max_indexes: int = 256,
+        enabled: bool = True,
+    ):
+        self.top_k = top_k
+        self.chunk_tokens = chunk_tokens
+        self.max_chunks = max(top_k, max_chunks)
+        self.min_score = min_score
+        self.max_indexes = max_indexes
+        self.enabled = enabled
+        self._indexes: OrderedDict[str, BM25Index] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def index(self, knowledge: str) -> BM25Index:
+        _hash = knowledge_hash(knowledge)
+        with self._lock:
+            _index = self._indexes.get(_hash)
+            if _index is not None:
+                self._indexes.move_to_end(_hash)
+                return _index
+        _index = BM25Index(split_chunks(knowledge, self.chunk_tokens))
+        with self._lock:
+            self._indexes[_hash] = _index
+            while len(self._indexes) > self.max_indexes:
+                self._indexes.popitem(last=False)
+        return _index
+
+    def select(self, question: str, knowledge: str, previous: list[int] = ()) -> tuple[str, list[int]]:
+        """
+        Knowledge to send with `question` and the selected chunk indices,
+        oldest selection first. `previous` are the indices selected earlier
+        in the conversation. The knowledge is sent as is (no indices) when it
+        already fits `top_k` chunks.
+        """
+        if not self.enabled or not knowledge or count_tokens(knowledge) <= self.top_k * self.chunk_tokens:
+            return knowledge, []
+        _index = self.index(knowledge)
+        _top = _index.top(question, self.top_k, self.min_score if previous else 0)
+        if not _top and not previous:
+            _top = list(range(min(self.top_k, len(_index.chunks))))
+        _selected = [i for i in previous if i not in _top] + _top
+        _selected = _selected[-self.max_chunks:]
+        return "\n".join(_index.chunks[i] for i in sorted(_selected)), _selected
@@ -1,39 +1,90 @@
 from typing import List
+import numpy as np
 import numpy.typing as npt
 import time
 import logging
 from PIL import Image
 from ._enum import *
 from .opencv import OpenCVRestorationProvider
-from .crfill import CRFillRestorationProvider
+from .crfill import CRFillRestorationProvider, DefaultConfig as CRFillConfig
 from .diffusion import DiffusionRestorationProvider
+from src.utils.registry import SharedModels
+from src.utils.result_cache import Results, array_hash, model_version, result_key
 
 
+# `<model>[-variant][-region]`, `crfill` runs on the `CRFILL_SERVER` backend,
+# `crfill-torch`/`crfill-onnx` force one. Quantized variants are built
+# offline by `python -m scripts.quantize_models`. `-region` inpaints
+# windows around the mask instead of the full image
+PROVIDERS = [f"crfill{option}{region}"
+             for option in ("", "-torch", "-onnx", "-int8", "-fp16")
+             for region in ("", "-region")] + ["opencv"]
+
 class RestorationController:
     def __init__(self, provider: str = "crfill"):
-        self.model = self.__get_provider(provider)
+        self.set_provider(provider)
 
     def __get_provider(self, provider: str):
-        if provider == "crfill":
-            return CRFillRestorationProvider()
-        elif provider == "opencv":
-            return OpenCVRestorationProvider()
+        if provider not in PROVIDERS:
+            raise ValueError(f"Provider {provider} invalid")
+
+        name, _, option = provider.removesuffix("-region").partition("-")
+        if name == "crfill":
+            # Resolve the backend here so `crfill` and `crfill-<server>`
+            # share one registry entry
+            _server = option if option in ("torch", "onnx") else CRFillConfig.server
+            _variant = "fp32" if option in ("", "torch", "onnx") else option
+            return SharedModels.get(name, CRFillRestorationProvider, variant=_variant, server=_server)
+        elif name == "opencv":
+            return SharedModels.get(name, OpenCVRestorationProvider)
         # elif provider == "diffusion":
         #     return DiffusionRestorationProvider()
         else:
             raise ValueError(f"Provider {provider} invalid")
 
     def set_provider(self, provider: str):
-        self.model = self.__get_provider(provider)
+        self.__get_provider(provider)
+        self.provider = provider
+
+    @property
+    def model(self):
+        return self.__get_provider(self.provider)
 
     def infer(
         self,
         images: List[npt.NDArray],
-        masks: List[npt.NDArray]
+        masks: List[npt.NDArray],
+        provider: str = None
     ) -> List[Image.Image]:
-        _s = time.time()
-        inpainteds = self.model.infer(images, masks)
-        logging.info(
-            f"Inferred {self.model.__class__.__name__} [{round(time.time() - _s, 4)}s]")
+        provider = provider or self.provider
+        _model = self.__get_provider(provider)
+
+        # Outputs of model-backed providers are cached by input content
+        _model_path = getattr(_model, "model_path", None) if Results.enabled else None
+        if _model_path is not None:
+            _version = result_key(provider, model_version(_model_path))
+            _keys = [result_key(_version, array_hash(image), array_hash(mask))
+                     for image, mask in zip(images, masks)]
+            inpainteds = [Results.get("restoration", key) for key in _keys]
+        else:
+            inpainteds = [None] * len(images)
+        _missing = [i for i, inpainted in enumerate(inpainteds) if inpainted is None]
+
+        if _missing:
+            _images = [images[i] for i in _missing]
+            _masks = [masks[i] for i in _missing]
+            _s = time.time()
+            if provider.endswith("-region"):
+                _inpainteds = _model.infer(_images, _masks, region=True)
+            else:
+                _inpainteds = _model.infer(_images, _masks)
+            logging.info(
+                f"Inferred {_model.__class__.__name__} [{round(time.time() - _s, 4)}s]")
+
+            for i, inpainted in zip(_missing, _inpainteds):
+                inpainteds[i] = inpainted
+            if _model_path is not None:
+                Results.put_later("restoration", [
+                    (_keys[i], np.asarray(inpainteds[i])) for i in _missing])
 
         return [Image.fromarray(i).convert('RGB') for i in inpainteds]
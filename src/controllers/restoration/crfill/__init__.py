@@ -1,81 +1,211 @@
+import os
+import math
+import time
 import torch
 import numpy as np
 from .._base import BaseRestorationProvider, BaseConfig
 from .._enum import InferenceServer
 from .model import BaseConvGenerator
-from src.utils.torch_infer import torch_inference
+from ._regions import RegionWindows
+from ._buckets import area_class, bucket_batches, pad_to
+from ._processing import CRFillProcessor
+from src.utils.torch_infer import torch_inference, TorchCompileMode, ScriptedModel, parse_shapes
 from src.utils.onnx_infer import onnx_interence_session, onnx_inference
 from src.utils.downloader import download_model_from_drive
+from src.utils.metrics import Metrics
 
 
 class DefaultConfig(BaseConfig):
     torch_model_id = "1Mr_AysRFFim5BHeQOhO9zZkuZ2eMAaBR"
     torch_model_name = "crfill.pth"
-    onnx_model_id = "1jjXsN5p4gWKXm_xuW5MlxkLASxygw470"
     onnx_model_name = "crfill.onnx"
+    # FP32 backend, `torch` or `onnx`
+    server = os.environ.get("CRFILL_SERVER", InferenceServer.Torch.value)
+    # Quantized variants, built by `python -m scripts.quantize_models crfill`
+    variant_model_names = {
+        "int8": "crfill.int8.onnx",
+        "fp16": "crfill.fp16.onnx",
+    }
+    # Region mode, grid cell and context margin in px (multiples of 4). The
+    # generator sees up to ~300 px, smaller margins trade exactness with the
+    # full-image output for speed
+    region_core = int(os.environ.get("CRFILL_REGION_CORE", 256))
+    region_margin = int(os.environ.get("CRFILL_REGION_MARGIN", 320))
+    region_batch_size = int(os.environ.get("CRFILL_REGION_BATCH_SIZE", 4))
+    # Torch backend execution, `eager` or `script`. The script module is
+    # built at load and run for `warmup_shapes` ([b]x[h]x[w], comma
+    # separated), by default a full image and a batch of region windows
+    torch_compile = TorchCompileMode
+    _window = region_core + 2 * region_margin + 8
+    warmup_shapes = os.environ.get(
+        "CRFILL_WARMUP_SHAPES", f"1x512x512,{region_batch_size}x{_window}x{_window}")
+    # Mixed-size batches, images are padded to a multiple of `bucket_multiple`
+    # and grouped by padded size, at most `batch_max_pixels` padded px a batch
+    bucket_multiple = int(os.environ.get("CRFILL_BUCKET_MULTIPLE", 8))
+    batch_max_pixels = int(
+        float(os.environ.get("CRFILL_BATCH_MAX_MEGAPIXELS", 4)) * 2**20)
 
 
 class CRFillRestorationProvider(BaseRestorationProvider):
-    def __init__(self, config=DefaultConfig):
+    def __init__(self, config=DefaultConfig, variant: str = "fp32", server: str = None):
         super().__init__(config)
-        self.model = self.__download_model()
+        self.variant = variant
+        self.processor = CRFillProcessor()
+
+        # Quantized variants only exist as ONNX models
+        self.server = InferenceServer(
+            server or config.server) if variant == "fp32" else InferenceServer.Onnx
+        if self.server == InferenceServer.Torch:
+            self.model = self.__download_model()
+            if config.torch_compile == "script":
+                self.model = ScriptedModel(self.model, "crfill", self.model_path)
+                self.model.warmup(self.__example_inputs,
+                                  parse_shapes(config.warmup_shapes))
+        elif self.server == InferenceServer.Onnx:
+            self.onnx_session = self.__load_onnx(variant)
+        else:
+            raise NotImplementedError(
+                f"{self.server.value} in CRFill is not implemented")
 
     def __download_model(self):
         _model = BaseConvGenerator()
         # Download torch model
-        _model_path = download_model_from_drive(
+        self.model_path = download_model_from_drive(
             self.config.torch_model_id, self.config.torch_model_name)
         # Load torch checkpoint
-        _model_state = torch.load(_model_path)
+        _model_state = torch.load(self.model_path)
         _model.load_state_dict(_model_state)
-        # Download onnx model
-        # _model_path = download_model_from_drive(
-        #     self.config.onnx_model_id, self.config.onnx_model_name)
-        # self.onnx_session = onnx_interence_session(_model_path)
-        return _model
-
-    def infer(self, images, masks):
-        # Preprocessing image, mask
-        imgs = torch.Tensor(
-            np.array(images)).div(255.).permute(0, 3, 1, 2)  # Shape [b, 3, h, w]
-        mks = torch.Tensor(np.array(masks)).unsqueeze(1)  # Shape [b, 1, h, w]
+        # Inputs arrive as NHWC buffers, keep convolutions in that layout
+        return _model.to(memory_format=torch.channels_last).eval()
+
+    def __example_inputs(self, batch: int, height: int, width: int):
+        _images = [np.zeros((height, width, 3), np.uint8)] * batch
+        _masks = [np.zeros((height, width), np.uint8)] * batch
+        return self.processor.torch_inputs(_images, _masks)
+
+    def __load_onnx(self, variant: str):
+        if variant == "fp32":
+            self.model_path = self.__export_onnx()
+        elif variant not in self.config.variant_model_names:
+            raise ValueError(f"CRFill variant {variant} invalid")
+        else:
+            self.model_path = os.path.join(
+                os.getcwd(), "models", self.config.variant_model_names[variant])
+            if not os.path.exists(self.model_path):
+                raise FileNotFoundError(
+                    f"{self.model_path} not found, run `python -m scripts.quantize_models crfill`")
+        _session = onnx_interence_session(self.model_path, name="crfill")
+        self.__check_dynamic_size(_session)
+        return _session
+
+    def __export_onnx(self) -> str:
+        """
+        FP32 model with dynamic height/width, `models/crfill.onnx`, exported
+        from the torch checkpoint when missing or fixed-size
+        """
+        # Imported here, the export script imports this module
+        from scripts.export_crfill_onnx import export, load_torch_model
+
+        _model_path = os.path.join(
+            os.getcwd(), "models", self.config.onnx_model_name)
+        if not os.path.exists(_model_path) or self.__has_fixed_size(
+                onnx_interence_session(_model_path, name="crfill")):
+            export(load_torch_model(), _model_path, opset=17, size=(256, 256))
+        return _model_path
+
+    def __has_fixed_size(self, session) -> bool:
+        _shape = session.get_inputs()[0].shape
+        return isinstance(_shape[2], int) or isinstance(_shape[3], int)
+
+    def __check_dynamic_size(self, session):
+        # Inputs are padded images of any size, a graph traced at one fixed
+        # size would fail on every other request
+        if self.__has_fixed_size(session):
+            _shape = session.get_inputs()[0].shape
+            raise ValueError(
+                f"{self.model_path} has fixed input size {_shape[2]}x{_shape[3]}, export one with "
+                "dynamic height/width by `python -m scripts.export_crfill_onnx`"
+                + ("" if self.variant == "fp32" else " then `python -m scripts.quantize_models crfill`"))
+
+    def __infer_onnx(self, images, masks):
+        # Run image by image when the exported batch axis is fixed
+        _batch = self.onnx_session.get_inputs()[0].shape[0]
+        _step = _batch if isinstance(_batch, int) else len(images)
+
+        results = []
+        for i in range(0, len(images), _step):
+            # Preprocessing
+            imgs, mks = self.processor.onnx_inputs(
+                images[i:i + _step], masks[i:i + _step])
+
+            # Inference
+            inpainteds = onnx_inference(self.onnx_session, imgs, mks)
+
+            # Postprocessing
+            results.extend(self.processor.onnx_outputs(inpainteds))
+        return results
+
+    def __infer_torch(self, images, masks):
+        # Preprocessing image, mask, shape [b, 3, h, w] channels_last, [b, 1, h, w]
+        imgs, mks = self.processor.torch_inputs(images, masks)
 
         # Inference
         inpainteds = torch_inference(self.model, imgs, mks)
 
         # Postprocessing image
-        inpainteds = inpainteds.numpy().astype(np.uint8)
-        return [i.transpose((1, 2, 0)) for i in inpainteds]
-
-        # if server == InferenceServer.Torch:
-        #     # Preprocessing image, mask
-        #     imgs = torch.Tensor(
-        #         np.array(images)).div(255.).permute(0, 3, 1, 2)  # Shape [b, 3, h, w]
-        #     mks = torch.Tensor(np.array(masks)).unsqueeze(
-        #         1)  # Shape [b, 1, h, w]
-
-        #     # Inference
-        #     inpainteds = torch_inference(self.model, imgs, mks)
-
-        #     # Postprocessing image
-        #     inpainteds = inpainteds.numpy().astype(np.uint8)
-        #     return [i.transpose((1, 2, 0)) for i in inpainteds]
-
-        # elif server == InferenceServer.Onnx:
-        #     # Preprocessing
-        #     imgs = (np.array(images).transpose(
-        #         0, 3, 1, 2) / 255).astype(np.float32)
-        #     mks = np.expand_dims(np.array(masks), axis=1).astype(np.float32)
-
-        #     # Inference
-        #     inpainteds = onnx_inference(self.onnx_session, imgs, mks)
-
-        #     # Postprocessing
-        #     inpainteds = inpainteds.astype(np.uint8)
-        #     return [i.transpose((1, 2, 0)) for i in inpainteds]
-
-        # elif server == InferenceServer.Triton:
-        #     raise NotImplementedError("Triton in CRFill is not implemented")
-
-        # else:
-        #     raise ValueError(f"Undefined Inference server!")
+        return self.processor.torch_outputs(inpainteds)
+
+    def __infer_batch(self, images, masks):
+        if self.server == InferenceServer.Onnx:
+            return self.__infer_onnx(images, masks)
+        return self.__infer_torch(images, masks)
+
+    def __infer_full(self, images, masks):
+        """
+        Run same-size buckets as one batch each, crop outputs back
+        """
+        results = [None] * len(images)
+        _sizes = [image.shape[:2] for image in images]
+        for _size, _indices in bucket_batches(_sizes, self.config.bucket_multiple, self.config.batch_max_pixels):
+            _s = time.perf_counter()
+            _results = self.__infer_batch(
+                [pad_to(images[i], _size) for i in _indices],
+                [pad_to(masks[i], _size) for i in _indices])
+            for i, result in zip(_indices, _results):
+                _h, _w = _sizes[i]
+                results[i] = result[:_h, :_w]
+
+            _bucket = f"crfill.bucket.{area_class(_size)}"
+            Metrics.observe(f"{_bucket}.batch_size", len(_indices))
+            Metrics.observe(f"{_bucket}.latency_ms",
+                            (time.perf_counter() - _s) * 1000)
+        return results
+
+    def __infer_regions(self, image, mask):
+        """
+        Inpaint windows around the masked grid cells only, so the cost
+        follows the crack area rather than the image size
+        """
+        # Windows start in phase with the downsampling and with the padding
+        # of a full-image pass
+        _windows = RegionWindows(
+            mask, self.config.region_core, self.config.region_margin,
+            align=math.lcm(4, self.config.bucket_multiple))
+        if not _windows.cells:
+            return np.array(image)
+        # Cracks spread over the whole image, one pass is cheaper
+        if _windows.area >= _windows.height * _windows.width:
+            return self.__infer_full([image], [mask])[0]
+
+        _images, _masks = _windows.crops(image), _windows.crops(mask)
+        _step = self.config.region_batch_size
+        results = []
+        for i in range(0, len(_images), _step):
+            results.extend(self.__infer_full(
+                _images[i:i + _step], _masks[i:i + _step]))
+        return _windows.paste(image, mask, results)
+
+    def infer(self, images, masks, region: bool = False):
+        if region:
+            return [self.__infer_regions(image, mask) for image, mask in zip(images, masks)]
+        return self.__infer_full(images, masks)
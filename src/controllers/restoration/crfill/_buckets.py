@@ -0,0 +1,62 @@
+"""
+Group mixed-size images into batches of one padded size
+"""
+from collections import defaultdict
+import cv2 as cv
+import numpy as np
+import numpy.typing as npt
+
+
+def padded_size(height: int, width: int, multiple: int) -> tuple[int, int]:
+    return -(-height // multiple) * multiple, -(-width // multiple) * multiple
+
+
+# Coarse labels of padded sizes for metrics, upper bounds in px
+AreaClasses = (("256", 256**2), ("512", 512**2), ("1k", 1024**2), ("2k", 2048**2))
+
+
+def area_class(size: tuple[int, int]) -> str:
+    """
+    Smallest class holding `size`, so metric names stay bounded whatever
+    the input sizes
+    """
+    _area = size[0] * size[1]
+    for name, max_area in AreaClasses:
+        if _area <= max_area:
+            return name
+    return "huge"
+
+
+def bucket_batches(
+    sizes: list[tuple[int, int]],
+    multiple: int,
+    max_pixels: int
+) -> list[tuple[tuple[int, int], list[int]]]:
+    """
+    Batches of image indices sharing one padded (h, w), each holding at most
+    `max_pixels` padded pixels (at least one image)
+    """
+    _buckets: dict[tuple[int, int], list[int]] = defaultdict(list)
+    for i, (h, w) in enumerate(sizes):
+        _buckets[padded_size(h, w, multiple)].append(i)
+
+    _batches = []
+    for (h, w), indices in _buckets.items():
+        _step = max(1, max_pixels // (h * w))
+        _batches += [((h, w), indices[i:i + _step])
+                     for i in range(0, len(indices), _step)]
+    return _batches
+
+
+def pad_to(array: npt.NDArray, size: tuple[int, int]) -> npt.NDArray:
+    """
+    Pad bottom/right to `size` by reflection. Masks are padded the same way,
+    so cracks reflected into the border stay masked and are not fed to the
+    generator as known pixels.
+    """
+    _h, _w = array.shape[:2]
+    if (_h, _w) == size:
+        return array
+    # Reflection needs the padding to be shorter than the image
+    _border = cv.BORDER_REFLECT_101 if min(_h, _w) > 8 else cv.BORDER_REPLICATE
+    return cv.copyMakeBorder(np.ascontiguousarray(array), 0, size[0] - _h, 0, size[1] - _w, _border)
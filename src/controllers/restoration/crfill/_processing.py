@@ -0,0 +1,54 @@
+import numpy as np
+import numpy.typing as npt
+import torch
+from src.utils.buffers import BufferPool
+
+
+class CRFillProcessor:
+    """
+    Pre/post-processing stage of CRFill working on reused buffers.
+
+    Images are normalized straight from uint8 into a pooled float32 batch in
+    one pass, without stacking or float64 temporaries. For torch the batch
+    is NHWC and wrapped by `torch.from_numpy`, so the model gets a
+    channels_last view without another copy; masks stay uint8. Outputs are
+    cast to uint8 NHWC in a single pass, one contiguous array per image.
+    """
+
+    def __init__(self):
+        self.pool = BufferPool()
+
+    def __normalize(self, images: list[npt.NDArray], batch: npt.NDArray, nchw: bool):
+        for i, image in enumerate(images):
+            _image = image.transpose(2, 0, 1) if nchw else image
+            np.divide(_image, np.float32(255), out=batch[i], casting="unsafe")
+
+    def torch_inputs(self, images: list[npt.NDArray], masks: list[npt.NDArray]) -> tuple[torch.Tensor, torch.Tensor]:
+        _h, _w = images[0].shape[:2]
+        _images = self.pool.get("torch_images", (len(images), _h, _w, 3), np.float32)
+        _masks = self.pool.get("torch_masks", (len(masks), _h, _w), np.uint8)
+        self.__normalize(images, _images, nchw=False)
+        for i, mask in enumerate(masks):
+            _masks[i] = mask
+
+        # [b, h, w, 3] buffer seen as a channels_last [b, 3, h, w] tensor
+        imgs = torch.from_numpy(_images).permute(0, 3, 1, 2)
+        mks = torch.from_numpy(_masks).unsqueeze(1)  # Shape [b, 1, h, w]
+        return imgs, mks
+
+    def onnx_inputs(self, images: list[npt.NDArray], masks: list[npt.NDArray]) -> tuple[npt.NDArray, npt.NDArray]:
+        _h, _w = images[0].shape[:2]
+        _images = self.pool.get("onnx_images", (len(images), 3, _h, _w), np.float32)
+        _masks = self.pool.get("onnx_masks", (len(masks), 1, _h, _w), np.float32)
+        self.__normalize(images, _images, nchw=True)
+        for i, mask in enumerate(masks):
+            _masks[i, 0] = mask
+        return _images, _masks
+
+    def torch_outputs(self, outputs: torch.Tensor) -> list[npt.NDArray[np.uint8]]:
+        # Channels_last outputs are NHWC in memory, the permute is free
+        return self.onnx_outputs(outputs.permute(0, 2, 3, 1).numpy(), nchw=False)
+
+    def onnx_outputs(self, outputs: npt.NDArray, nchw: bool = True) -> list[npt.NDArray[np.uint8]]:
+        _outputs = outputs.transpose(0, 2, 3, 1) if nchw else outputs
+        return list(_outputs.astype(np.uint8, order="C"))
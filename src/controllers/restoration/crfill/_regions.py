@@ -0,0 +1,81 @@
+"""
+Split masked areas into fixed-size windows so CRFill only runs where the
+mask is, then paste the inpainted pixels back
+"""
+import numpy as np
+import numpy.typing as npt
+
+
+def mask_cells(mask: npt.NDArray, core: int) -> list[tuple[int, int]]:
+    """
+    Top-left corners of the `core`-px grid cells containing mask pixels
+    """
+    _height, _width = mask.shape[:2]
+    _gh, _gw = -(-_height // core), -(-_width // core)
+    _occupied = np.zeros((_gh * core, _gw * core), dtype=bool)
+    _occupied[:_height, :_width] = mask > 0
+    _occupied = _occupied.reshape(_gh, core, _gw, core).any(axis=(1, 3))
+    return [(int(y) * core, int(x) * core) for y, x in zip(*np.nonzero(_occupied))]
+
+
+def window_size(core: int, margin: int, align: int, length: int) -> int:
+    """
+    Window length covering a cell and `margin` px on both sides whatever
+    the rounding of its start, grown so a window clamped to the far border
+    also starts on a multiple of `align`
+    """
+    _window = core + 2 * margin + align
+    if _window >= length:
+        return length
+    return _window + (length - _window) % align
+
+
+def window_start(cell: int, margin: int, window: int, length: int, align: int) -> int:
+    # Start on a multiple of `align` so the stride-2 convolutions keep the
+    # phase of a full-image pass, and stay inside the image so borders see
+    # the same padding
+    return min(max(cell - margin, 0) // align * align, length - window)
+
+
+class RegionWindows:
+    """
+    Windows of about `core + 2 * margin` px around every occupied grid cell.
+
+    Windows have the same size within one image, so they are batched
+    together. Only the cell (core) area of a window is pasted back. Window
+    starts are multiples of `align` (the downsampling factor, and the padding
+    multiple of full-image batches), so with a margin covering the receptive
+    field the pasted pixels match a full-image pass.
+    """
+
+    def __init__(self, mask: npt.NDArray, core: int, margin: int, align: int = 4):
+        self.height, self.width = mask.shape[:2]
+        self.core = core
+        self.window_h = window_size(core, margin, align, self.height)
+        self.window_w = window_size(core, margin, align, self.width)
+        self.cells = mask_cells(mask, core)
+        self.starts = [
+            (window_start(cy, margin, self.window_h, self.height, align),
+             window_start(cx, margin, self.window_w, self.width, align))
+            for cy, cx in self.cells
+        ]
+
+    @property
+    def area(self) -> int:
+        return len(self.cells) * self.window_h * self.window_w
+
+    def crops(self, array: npt.NDArray) -> list[npt.NDArray]:
+        return [array[y:y + self.window_h, x:x + self.window_w] for y, x in self.starts]
+
+    def paste(self, image: npt.NDArray, mask: npt.NDArray, results: list[npt.NDArray]) -> npt.NDArray:
+        """
+        Copy of `image` with masked pixels of every cell taken from its window
+        """
+        _output = np.array(image)
+        for (cy, cx), (y, x), result in zip(self.cells, self.starts, results):
+            _cell = (slice(cy, cy + self.core), slice(cx, cx + self.core))
+            _h, _w = _output[_cell].shape[:2]
+            _result = result[cy - y:cy - y + _h, cx - x:cx - x + _w]
+            _masked = mask[_cell] > 0
+            _output[_cell][_masked] = _result[_masked]
+        return _output
@@ -104,16 +104,29 @@ class BaseConvGenerator(nn.Module):
         self.allconv16 = GenConv(cnum//2, cnum//2, 3, 1)
         self.allconv17 = GenConv(cnum//4, 3, 3, 1, activation=None)
 
+    def _ones(self, x):
+        # Reuse the constant ones channel between calls of the same shape.
+        # Traced graphs must build it from the input shape instead.
+        bsize, ch, height, width = x.shape
+        if torch.jit.is_tracing() or torch.onnx.is_in_onnx_export():
+            return torch.ones(bsize, 1, height, width, dtype=x.dtype, device=x.device)
+        key = (bsize, height, width, x.dtype, x.device)
+        cached = getattr(self, "_ones_cache", None)
+        if cached is None or cached[0] != key:
+            cached = self._ones_cache = (key, torch.ones(
+                bsize, 1, height, width, dtype=x.dtype, device=x.device))
+        return cached[1]
+
     def forward(self, image, mask):
-        # Preprocessing inputs
-        mask = (mask > 0) * 1
-        inputs = image * (1 - mask)
+        # Preprocessing inputs, the mask may be uint8 or float
+        mask = mask.gt(0).to(image.dtype)
+        inv_mask = 1 - mask
+        inputs = image * inv_mask
         x = inputs
 
         xin = x
-        bsize, ch, height, width = x.shape
-        ones_x = torch.ones(bsize, 1, height, width).to(x.device)
-        x = torch.cat([x, ones_x, ones_x*mask], 1)
+        ones_x = self._ones(x)
+        x = torch.cat([x, ones_x, mask], 1)
 
         # two stage network
         # stage1
@@ -137,7 +150,7 @@ class BaseConvGenerator(nn.Module):
         x = torch.tanh(x)
         x_stage1 = x
 
-        x = x*mask + xin[:, 0:3, :, :]*(1.-mask)
+        x = x*mask + xin[:, 0:3, :, :]*inv_mask
         xnow = x
 
         ###
@@ -179,7 +192,7 @@ class BaseConvGenerator(nn.Module):
             return x_stage1, x_stage2, pm_return
 
         # Posprocessing image
-        x_stage2 = x_stage2 * mask + inputs * (1 - mask)
+        x_stage2 = x_stage2 * mask + inputs * inv_mask
         x_stage2 = torch.clamp(x_stage2, -1, 1) * 255.
 
         return x_stage2
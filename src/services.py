@@ -1,22 +1,50 @@
 import traceback
 import os
 import dotenv
+from functools import partial
 from dataclasses import dataclass, field
 from typing import Annotated, List
 from fastapi import FastAPI, Request, Response, UploadFile, File, Form, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import RedirectResponse, StreamingResponse
-from .controllers.restoration import RestorationController
-from .controllers.crack_detection import CrackSegController
-from .controllers.llm import LLMInputs, LLMController
-from src.utils.static import save_images, save_file, loads_static
+from fastapi.responses import RedirectResponse, StreamingResponse, FileResponse
+from .controllers.restoration import RestorationController, PROVIDERS as RESTORATION_PROVIDERS
+from .controllers.crack_detection import CrackSegController, PROVIDERS as CRACKSEG_PROVIDERS
+from .controllers.llm import LLMInputs, LLMController, LLMProvider
+from src.utils.static import StaticDirectory, save_images, save_stream, loads_static, parallel_map, UploadTooLarge
 from src.utils.client import get_client, Client
 from src.utils.response import ResponseData
-from src.utils.image_utils import visualize_image_with_mask
+from src.utils.overlays import OverlayDirectory, overlay_path, render_overlay
+from src.utils.executor import Executor, ExecutorSaturated
+from src.utils.batcher import MicroBatcher
+from src.utils.metrics import Metrics
+from src.utils.compute import Compute
+from src.utils.streaming import coalesce, until_disconnected, sse
+from src.utils.upload_limit import UploadSizeLimit
 
 dotenv.load_dotenv(dotenv.find_dotenv())
 
 
+UploadMaxFileBytes = int(float(os.environ.get("UPLOAD_MAX_FILE_MB", 50)) * 2**20)
+UploadMaxRequestBytes = int(
+    float(os.environ.get("UPLOAD_MAX_REQUEST_MB", 500)) * 2**20)
+# LLM stream chunks are flushed after this many ms or bytes
+StreamFlushMs = float(os.environ.get("LLM_STREAM_FLUSH_MS", 50))
+StreamFlushBytes = int(os.environ.get("LLM_STREAM_FLUSH_BYTES", 256))
+# Render crack-seg overlays in the request instead of on first download
+EagerOverlays = os.environ.get("CRACKSEG_EAGER_OVERLAYS", "0").lower() in ("1", "true")
+
+
+def raise_busy(e: ExecutorSaturated):
+    """
+    Reply 503 when an inference pool is saturated
+    """
+    raise HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"}
+    )
+
+
 @dataclass
 class Services:
     """API Services"""
@@ -31,6 +59,7 @@ class Services:
         self.restoration = RestorationController()
         self.crackseg = CrackSegController()
         self.llm = LLMController()
+        self.crackseg_batchers: dict[str, MicroBatcher] = {}
 
         # Middleware
         self.app.add_middleware(
@@ -41,6 +70,9 @@ class Services:
             allow_headers=["*"],
         )
 
+        self.app.add_middleware(
+            UploadSizeLimit, path="/api/uploads", max_bytes=UploadMaxRequestBytes)
+
         # Register routes
         self.app.get("/")(self.main)
         self.app.post("/api/uploads")(self.uploads)
@@ -48,6 +80,9 @@ class Services:
         self.app.post("/api/restore")(self.restoration_infer)
         self.app.post("/api/llm")(self.chat_llm)
         self.app.get("/api/azure_key")(self.get_azure_api_key)
+        self.app.get("/api/metrics")(self.get_metrics)
+        # Matched before the static files mount
+        self.app.get(f"/{StaticDirectory}/{OverlayDirectory}/{{name}}")(self.get_overlay)
 
     async def main(self):
         """
@@ -64,6 +99,46 @@ class Services:
 
         return ResponseData({"token": speech_key, "region": speech_region})
 
+    async def get_metrics(self):
+        """
+        Get batching, latency and executor metrics, CPU allotments and the
+        LLM answers cache
+        """
+        return ResponseData({
+            **Metrics.snapshot(),
+            "compute": Compute.snapshot(),
+            "llm_cache": self.llm.cache.snapshot(),
+        })
+
+    async def get_overlay(self, name: str):
+        """
+        Crack overlay, rendered from its upload and mask on the first request
+        """
+        try:
+            _path = await Executor.run("io", render_overlay, name)
+        except ExecutorSaturated as e:
+            raise_busy(e)
+        if _path is None:
+            raise HTTPException(status_code=404, detail="Not Found")
+        return FileResponse(_path)
+
+    def crackseg_batcher(self, provider: str) -> MicroBatcher:
+        """
+        Shared batcher per crack segmentation provider
+        """
+        if provider not in CRACKSEG_PROVIDERS:
+            raise ValueError(f"Provider {provider} invalid")
+        if provider not in self.crackseg_batchers:
+            self.crackseg_batchers[provider] = MicroBatcher(
+                f"crackseg.{provider}",
+                partial(self.crackseg.predict, provider=provider),
+                # Variants of one model share its pool
+                pool=provider.split("-")[0],
+                max_batch_size=int(os.environ.get("CRACKSEG_BATCH_MAX_SIZE", 16)),
+                window_ms=float(os.environ.get("CRACKSEG_BATCH_WINDOW_MS", 10)),
+            )
+        return self.crackseg_batchers[provider]
+
     async def uploads(
         self,
         upload_files: Annotated[List[UploadFile], File(...)],
@@ -73,19 +148,30 @@ class Services:
         Uploads
         """
         _paths = []
+        _remaining = UploadMaxRequestBytes
 
-        # Iterate over upload files
-        for upload_file in upload_files:
-            # Read file extension
-            file_ext = upload_file.filename.split(".")[-1]
-            # Save file
-            _paths.append(save_file("uploads", upload_file.file, file_ext))
+        # Iterate over upload files, streaming each one to disk
+        try:
+            for upload_file in upload_files:
+                # Read file extension
+                file_ext = upload_file.filename.split(".")[-1]
+                # Save file
+                _path, _size = await Executor.run(
+                    "io", save_stream, "uploads", upload_file.file, file_ext,
+                    min(UploadMaxFileBytes, _remaining))
+                _paths.append(_path)
+                _remaining -= _size
+        except UploadTooLarge as e:
+            for _path in _paths:
+                os.remove(_path)
+            raise HTTPException(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
 
         _response = {
             "uploads": _paths
         }
         client.update(_response)
-        client.save()
+        await Executor.run("io", client.save)
 
         return ResponseData(_response)
 
@@ -94,9 +180,11 @@ class Services:
         client: Annotated[Client, Depends(get_client)],
         threshold: Annotated[float, Form(...)] = 0.65,
         provider: Annotated[str, Form(...)] = "segformer",
+        eager_overlays: Annotated[bool, Form(...)] = EagerOverlays,
     ):
         """
-        Crack segmentation
+        Crack segmentation. Overlay URLs are rendered on their first download
+        unless `eager_overlays` is set.
         """
         # Retrieve uploaded files
         _uploads = client.data.get("uploads", None)
@@ -105,12 +193,27 @@ class Services:
                 status_code=400, detail="Uploads required. Do /uploads first.")
 
         # Load images
-        _images = loads_static(_uploads)
+        _images = await Executor.run("io", loads_static, _uploads)
 
         # Inference
         try:
-            self.crackseg.set_provider(provider)
-            _results = self.crackseg.infer(_images, threshold)
+            # Maps cached by image content skip inference, so a new threshold
+            # is cheap. Hashing runs off the inference pool.
+            _keys, _probs = await Executor.run(
+                "postprocess", self.crackseg.cached, _images, provider=provider)
+            _missing = [i for i, prob in enumerate(_probs) if prob is None]
+            if _missing:
+                # Coalesce with concurrent requests, then threshold per request
+                _predicted = await self.crackseg_batcher(provider).submit(
+                    [_images[i] for i in _missing])
+                for i, prob in zip(_missing, _predicted):
+                    _probs[i] = prob
+                if _keys:
+                    self.crackseg.cache([_keys[i] for i in _missing], _predicted)
+            _results = await Executor.run(
+                "postprocess", self.crackseg.postprocess, _images, _probs, threshold, provider=provider)
+        except ExecutorSaturated as e:
+            raise_busy(e)
         except Exception as e:
             traceback.print_exc()
             raise HTTPException(
@@ -118,12 +221,13 @@ class Services:
                 detail=str(e)
             )
 
-        # Format results image
-        _overlays = visualize_image_with_mask(_images, _results)
-
-        # Save results
-        _mask_path = save_images("crackseg_masks", _results)
-        _overlay_path = save_images("crackseg_results", _overlays)
+        # Save results, overlay names point back to the upload and mask
+        _mask_path = await Executor.run(
+            "io", save_images, "crackseg_masks", _results, cache=True)
+        _overlay_path = [overlay_path(upload, mask)
+                         for upload, mask in zip(_uploads, _mask_path)]
+        if eager_overlays:
+            await Executor.run("io", parallel_map, lambda p: render_overlay(os.path.basename(p)), _overlay_path)
 
         # Update client data
         _response = {
@@ -131,7 +235,7 @@ class Services:
             "results": _overlay_path
         }
         client.update(_response)
-        client.save()
+        await Executor.run("io", client.save)
 
         return ResponseData(_response)
 
@@ -153,13 +257,18 @@ class Services:
                 status_code=400, detail="Images and masks required. Do /uploads and /crack_seg first.")
 
         # Load images, masks
-        _images = loads_static(_images, type="np")
-        _masks = loads_static(_masks, mode="L", type="np")
+        _images = await Executor.run("io", loads_static, _images, type="np")
+        _masks = await Executor.run("io", loads_static, _masks, mode="L", type="np")
 
         # Inference
         try:
-            self.restoration.set_provider(provider)
-            _results = self.restoration.infer(_images, _masks)
+            if provider not in RESTORATION_PROVIDERS:
+                raise ValueError(f"Provider {provider} invalid")
+            # Variants of one model share its pool
+            _results = await Executor.run(
+                provider.split("-")[0], self.restoration.infer, _images, _masks, provider=provider)
+        except ExecutorSaturated as e:
+            raise_busy(e)
         except Exception as e:
             traceback.print_exc()
             raise HTTPException(
@@ -168,43 +277,55 @@ class Services:
             )
 
         # Save results
-        _paths = save_images("restore", _results)
+        _paths = await Executor.run("io", save_images, "restore", _results)
 
         # Update client data
         _response = {
             "restore": _paths
         }
         client.update(_response)
-        client.save()
+        await Executor.run("io", client.save)
 
         return ResponseData(_response)
 
-    async def chat_llm(self, data: LLMInputs):
+    async def chat_llm(
+        self,
+        data: LLMInputs,
+        request: Request,
+        client: Annotated[Client, Depends(get_client)],
+    ):
         """
         Chat with LLM
         """
         try:
-            if data.provider == "all":
-                answers = self.llm.generate_choices(
-                    data.question, data.knowledge)
-                return ResponseData({
-                    "answer": answers
-                })
-
-            # Set provider
-            self.llm.set_provider(data.provider)
+            if data.provider == LLMProvider.all:
+                # Providers are queried concurrently on the event loop
+                answers = await self.llm.agenerate_choices(
+                    data.question, data.knowledge, first=data.first_answer, client_id=client.id)
+                return ResponseData(answers)
 
             # Infer based on stream or not
             if data.use_stream:
-                result = self.llm.generate_async(
-                    prompt=data.question, knowledge=data.knowledge)
+                # Native async stream, coalesced and stopped on disconnect
+                result = until_disconnected(coalesce(
+                    self.llm.astream(
+                        prompt=data.question, knowledge=data.knowledge, provider=data.provider,
+                        client_id=client.id),
+                    max_delay_ms=StreamFlushMs, max_bytes=StreamFlushBytes,
+                ), request.is_disconnected)
+                if data.stream_format == "sse":
+                    return StreamingResponse(sse(result), media_type="text/event-stream")
                 return StreamingResponse(result, media_type="text/plain")
             else:
-                result = self.llm.generate(
-                    prompt=data.question, knowledge=data.knowledge)
+                result = await Executor.run(
+                    data.provider.value, self.llm.generate,
+                    prompt=data.question, knowledge=data.knowledge, provider=data.provider,
+                    client_id=client.id)
                 return ResponseData({
                     "answer": result
                 })
+        except ExecutorSaturated as e:
+            raise_busy(e)
         except Exception as e:
             traceback.print_exc()
             raise HTTPException(
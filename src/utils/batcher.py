@@ -0,0 +1,123 @@
+"""
+Coalesce items from concurrent requests into shared model batches
+"""
+import time
+import asyncio
+from typing import Any, Callable
+from src.utils.executor import Executor
+from src.utils.metrics import Metrics
+
+
+class MicroBatcher:
+    """
+    Collect items submitted by concurrent requests for up to `window_ms`
+    or until `max_batch_size` items are queued, run `fn(items)` once on the
+    executor pool `pool`, and scatter the results back to each caller.
+
+    At most `max_in_flight` batches are dispatched at once (default: the
+    pool's concurrency plus one batch waiting), so a large request queues
+    here instead of saturating the pool. Batchers sharing a pool stay within
+    its queue that way.
+
+    Metrics (under `name`):
+    - `request_latency_ms`: submit to results, per request
+    - `queue_wait_ms`: enqueue to batch dispatch, per item
+    - `batch_fill_ratio`: batch size / `max_batch_size`, per batch
+    """
+
+    def __init__(
+        self,
+        name: str,
+        fn: Callable[[list], list],
+        pool: str,
+        max_batch_size: int = 16,
+        window_ms: float = 10.0,
+        max_in_flight: int = None,
+    ):
+        self.name = name
+        self.fn = fn
+        self.pool = pool
+        self.max_batch_size = max_batch_size
+        self.window = window_ms / 1000
+        self.max_in_flight = max_in_flight or Executor.pool(pool).concurrency + 1
+        self._loop = None
+        self._queue = None
+        self._slots = None
+        self._task = None
+
+    def __ensure_worker(self):
+        # The collector belongs to the loop it was started on
+        _loop = asyncio.get_running_loop()
+        if self._loop is not _loop or self._task is None or self._task.done():
+            self._loop = _loop
+            self._queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+            self._task = _loop.create_task(self.__collect())
+
+    async def submit(self, items: list) -> list:
+        self.__ensure_worker()
+        _s = time.perf_counter()
+
+        _futures = []
+        for item in items:
+            _future = self._loop.create_future()
+            self._queue.put_nowait((item, _future, time.perf_counter()))
+            _futures.append(_future)
+
+        _results = await asyncio.gather(*_futures, return_exceptions=True)
+        Metrics.observe(f"{self.name}.request_latency_ms",
+                        (time.perf_counter() - _s) * 1000)
+        for _result in _results:
+            if isinstance(_result, Exception):
+                raise _result
+        return _results
+
+    async def __collect(self):
+        while True:
+            # Wait for a free slot first, items keep queuing meanwhile and
+            # fill the next batch
+            await self._slots.acquire()
+            _batch = [await self._queue.get()]
+            _deadline = time.perf_counter() + self.window
+
+            # Poll the queue until the window closes or the batch is full
+            while len(_batch) < self.max_batch_size:
+                while not self._queue.empty() and len(_batch) < self.max_batch_size:
+                    _batch.append(self._queue.get_nowait())
+                _remaining = _deadline - time.perf_counter()
+                if len(_batch) >= self.max_batch_size or _remaining <= 0:
+                    break
+                await asyncio.sleep(min(_remaining, 0.001))
+
+            self._loop.create_task(self.__run(_batch))
+
+    async def __run(self, batch: list[tuple[Any, asyncio.Future, float]]):
+        try:
+            await self.__dispatch(batch)
+        finally:
+            self._slots.release()
+
+    async def __dispatch(self, batch: list[tuple[Any, asyncio.Future, float]]):
+        # Skip items whose request was cancelled while queued
+        batch = [b for b in batch if not b[1].done()]
+        if not batch:
+            return
+
+        _now = time.perf_counter()
+        for _, _, _queued in batch:
+            Metrics.observe(f"{self.name}.queue_wait_ms",
+                            (_now - _queued) * 1000)
+        Metrics.observe(f"{self.name}.batch_fill_ratio",
+                        len(batch) / self.max_batch_size)
+
+        try:
+            _results = await Executor.run(self.pool, self.fn, [b[0] for b in batch])
+        except Exception as e:
+            for _, _future, _ in batch:
+                if not _future.done():
+                    _future.set_exception(e)
+            return
+
+        for (_, _future, _), _result in zip(batch, _results):
+            if not _future.done():
+                _future.set_result(_result)
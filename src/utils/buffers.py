@@ -0,0 +1,33 @@
+import threading
+import numpy as np
+import numpy.typing as npt
+
+
+class BufferPool:
+    """
+    Thread-local pool of reusable numpy buffers.
+
+    Each named buffer keeps a flat backing array that only grows, so asking
+    for a smaller shape later returns a view without reallocating. Buffers
+    are local to the calling thread, so a model shared by concurrent
+    requests never sees another request's data.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def get(self, name: str, shape: tuple, dtype=np.float32) -> npt.NDArray:
+        _buffers = getattr(self._local, "buffers", None)
+        if _buffers is None:
+            _buffers = self._local.buffers = {}
+
+        _dtype = np.dtype(dtype)
+        _size = int(np.prod(shape))
+        _flat = _buffers.get(name)
+        if _flat is None or _flat.dtype != _dtype or _flat.size < _size:
+            _flat = _buffers[name] = np.empty(_size, dtype=_dtype)
+
+        return _flat[:_size].reshape(shape)
+
+    def clear(self):
+        self._local.buffers = {}
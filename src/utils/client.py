@@ -1,36 +1,32 @@
-import os
-import json
-from src.utils.static import StaticDirectory
+from src.utils.session_store import SessionStore, create_session_store
 
 
-class Client:
-    def __init__(self, client_id: str):
-        self._path = os.path.join(os.getcwd(), StaticDirectory, "data.json")
-        self.id = client_id
-        self.data = self.__fetch_client()
+SharedStore: SessionStore = None
 
-    def __fetch_client(self) -> dict:
-        with open(self._path, "r") as f:
-            data = json.load(f)
-            f.close()
-            return data.get(self.id, {})
 
-    def save(self):
-        # Read data
-        with open(self._path, "r") as f:
-            data = json.load(f)
-            f.close()
+def get_session_store() -> SessionStore:
+    global SharedStore
+    if SharedStore is None:
+        SharedStore = create_session_store()
+    return SharedStore
 
-        # Update current client data
-        data[self.id] = self.data
 
-        # Save data
-        with open(self._path, "w") as f:
-            json.dump(data, f)
-            f.close()
+class Client:
+    def __init__(self, client_id: str, store: SessionStore = None):
+        self.store = store or get_session_store()
+        self.id = client_id
+        self.data = self.store.get(self.id)
+        self._updates = {}
+
+    def save(self):
+        # Only write keys changed by this request, so concurrent requests
+        # of the same client do not overwrite each other
+        self.data = self.store.merge(self.id, self._updates)
+        self._updates = {}
 
     def update(self, data: dict):
         self.data.update(data)
+        self._updates.update(data)
 
 
 def get_client():
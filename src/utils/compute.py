@@ -0,0 +1,143 @@
+"""
+Split the host CPU budget between the torch and ONNX Runtime models of this
+process, so concurrent crack-seg and restore calls do not oversubscribe cores
+"""
+import os
+import logging
+import threading
+from dataclasses import dataclass, asdict
+
+
+def available_cores() -> list[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def parse_allotments(value: str) -> dict[str, int]:
+    """
+    `seg_former=2,crfill=4` to {"seg_former": 2, "crfill": 4}
+    """
+    _allotments = {}
+    for _item in filter(None, value.split(",")):
+        _name, _, _threads = _item.partition("=")
+        _allotments[_name.strip()] = int(_threads)
+    return _allotments
+
+
+def configured_ort_models() -> str:
+    """
+    ONNX Runtime models of the configured backends: SegFormer always,
+    CRFill only with `CRFILL_SERVER=onnx` (it runs on torch by default)
+    """
+    _models = ["seg_former"]
+    if os.environ.get("CRFILL_SERVER", "torch").lower() == "onnx":
+        _models.append("crfill")
+    return ",".join(_models)
+
+
+@dataclass
+class Allotment:
+    threads: int
+    # Cores the threads are pinned to, None when pinning is off
+    cores: list[int] = None
+
+
+class ComputeResources:
+    """
+    Process-wide CPU budget.
+
+    The first `budget * torch_share` cores go to torch, whose intra-op pool
+    is shared by every torch model of the process. The remaining cores are
+    split evenly between the ONNX Runtime models in `ort_models`, unless a
+    model has an explicit thread count in `threads`. With `pin` on, every
+    allotment gets its own core range: torch inference threads through
+    `sched_setaffinity`, ORT sessions through intra-op thread affinities.
+    """
+
+    def __init__(
+        self,
+        budget: int = 0,
+        torch_share: float = 0.5,
+        ort_models: list[str] = None,
+        threads: dict[str, int] = None,
+        pin: bool = False,
+        managed: bool = True,
+    ):
+        _cores = available_cores()
+        self.cores = _cores[:budget] if budget > 0 else _cores
+        self.managed = managed
+        self.pin = pin and hasattr(os, "sched_setaffinity")
+        self.ort_models = ort_models or []
+        self.threads = threads or {}
+        self._local = threading.local()
+
+        _budget = len(self.cores)
+        _torch_threads = max(1, min(_budget, round(_budget * torch_share)))
+        self.torch = Allotment(self.threads.get("torch", _torch_threads))
+        self.ort: dict[str, Allotment] = {}
+
+        if self.pin:
+            self.torch.cores = self.cores[:_torch_threads]
+
+        # ORT models share what torch leaves, at least one core each
+        self.ort_cores = self.cores[_torch_threads:] or self.cores
+        _share = max(1, len(self.ort_cores) // max(1, len(self.ort_models)))
+        for i, _name in enumerate(self.ort_models):
+            _start = i * _share % len(self.ort_cores)
+            self.ort[_name] = self.__ort(_name, self.ort_cores[_start:_start + _share])
+
+    def __ort(self, name: str, cores: list[int]) -> Allotment:
+        return Allotment(self.threads.get(name, len(cores)), cores if self.pin else None)
+
+    def ort_allotment(self, name: str) -> Allotment | None:
+        if not self.managed:
+            return None
+        if name not in self.ort:
+            # Models outside `ort_models` get the whole ORT share
+            self.ort[name] = self.__ort(name, self.ort_cores)
+        return self.ort[name]
+
+    def configure_torch(self):
+        """
+        Size the torch intra/inter-op pools, once per process
+        """
+        if not self.managed:
+            return
+        import torch
+        torch.set_num_threads(self.torch.threads)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Inter-op pool already started
+            pass
+        logging.info(
+            f"🧮 Torch threads={self.torch.threads}, cores={self.torch.cores or 'any'}")
+
+    def pin_torch_thread(self):
+        """
+        Pin the calling thread to the torch cores before its first torch op,
+        OpenMP workers it starts inherit the affinity
+        """
+        if not self.managed or not self.torch.cores or getattr(self._local, "pinned", False):
+            return
+        os.sched_setaffinity(0, self.torch.cores)
+        self._local.pinned = True
+
+    def snapshot(self) -> dict:
+        return {
+            "managed": self.managed,
+            "cores": len(self.cores),
+            "torch": asdict(self.torch),
+            "ort": {name: asdict(allotment) for name, allotment in self.ort.items()},
+        }
+
+
+Compute = ComputeResources(
+    budget=int(os.environ.get("COMPUTE_CPU_BUDGET", 0)),
+    torch_share=float(os.environ.get("COMPUTE_TORCH_SHARE", 0.5)),
+    ort_models=os.environ.get("COMPUTE_ORT_MODELS", configured_ort_models()).split(","),
+    threads=parse_allotments(os.environ.get("COMPUTE_THREADS", "")),
+    pin=os.environ.get("COMPUTE_PIN_CORES", "0").lower() in ("1", "true"),
+    managed=os.environ.get("COMPUTE_MANAGED", "1").lower() in ("1", "true"),
+)
@@ -0,0 +1,100 @@
+"""
+Run blocking model and I/O calls off the asyncio event loop
+"""
+import os
+import asyncio
+import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable
+
+
+# Default (concurrency, queue size) per pool, override with
+# `EXECUTOR_<NAME>_CONCURRENCY` and `EXECUTOR_<NAME>_QUEUE`
+DefaultPoolSizes = {
+    "segformer": (1, 8),
+    "crfill": (1, 4),
+    "opencv": (2, 8),
+    "postprocess": (2, 32),
+    "gemini": (8, 32),
+    "gpt": (8, 32),
+    "llm": (4, 16),
+    "io": (4, 64),
+}
+
+
+class ExecutorSaturated(Exception):
+    """Raised when a pool has no free worker and its queue is full"""
+
+
+class BoundedPool:
+    """
+    Thread pool running at most `concurrency` calls at once with at most
+    `queue_size` calls waiting. Submitting past that raises
+    `ExecutorSaturated` instead of growing the backlog.
+    """
+
+    def __init__(self, name: str, concurrency: int, queue_size: int):
+        self.name = name
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.pending = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix=f"executor-{name}")
+
+    def __release(self, _future):
+        with self._lock:
+            self.pending -= 1
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        with self._lock:
+            if self.pending >= self.concurrency + self.queue_size:
+                raise ExecutorSaturated(
+                    f"Executor {self.name} is saturated ({self.pending} pending calls)")
+            self.pending += 1
+
+        # Count the call until the thread finishes, even if the caller is cancelled
+        _future = self._executor.submit(functools.partial(fn, *args, **kwargs))
+        _future.add_done_callback(self.__release)
+        return await asyncio.wrap_future(_future)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+class InferenceExecutor:
+    """Lazily created bounded pools, one per provider name"""
+
+    def __init__(self, pool_sizes: dict[str, tuple[int, int]] = DefaultPoolSizes):
+        self.pool_sizes = pool_sizes
+        self._pools: dict[str, BoundedPool] = {}
+        self._lock = threading.Lock()
+
+    def pool(self, name: str) -> BoundedPool:
+        with self._lock:
+            if name not in self._pools:
+                _concurrency, _queue_size = self.pool_sizes.get(name, (1, 8))
+                _env = name.upper().replace("-", "_")
+                _concurrency = int(os.environ.get(
+                    f"EXECUTOR_{_env}_CONCURRENCY", _concurrency))
+                _queue_size = int(os.environ.get(
+                    f"EXECUTOR_{_env}_QUEUE", _queue_size))
+                self._pools[name] = BoundedPool(
+                    name, _concurrency, _queue_size)
+                logging.info(
+                    f"🧵 Executor {name}: concurrency={_concurrency}, queue={_queue_size}")
+            return self._pools[name]
+
+    async def run(self, name: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        return await self.pool(name).run(fn, *args, **kwargs)
+
+    def shutdown(self):
+        with self._lock:
+            for _pool in self._pools.values():
+                _pool.shutdown()
+            self._pools.clear()
+
+
+Executor = InferenceExecutor()
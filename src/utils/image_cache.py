@@ -0,0 +1,67 @@
+"""
+Bounded cache of decoded images, keyed by path, mode and mtime
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+import numpy.typing as npt
+
+
+class DecodedImageCache:
+    """
+    LRU cache of decoded arrays with a byte budget.
+
+    Entries are keyed by (absolute path, PIL mode, mtime), so a file rewritten
+    on disk is decoded again. Cached arrays are read-only and shared between
+    callers.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries: OrderedDict[tuple, npt.NDArray] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(path: str, mode: str) -> tuple:
+        _path = os.path.abspath(path)
+        return (_path, mode, os.stat(_path).st_mtime_ns)
+
+    def get(self, path: str, mode: str) -> npt.NDArray | None:
+        try:
+            _key = self._key(path, mode)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            _array = self._entries.get(_key)
+            if _array is not None:
+                self._entries.move_to_end(_key)
+            return _array
+
+    def put(self, path: str, mode: str, array: npt.NDArray) -> npt.NDArray:
+        _array = np.ascontiguousarray(array)
+        _array.setflags(write=False)
+        if _array.nbytes > self.max_bytes:
+            return _array
+
+        _key = self._key(path, mode)
+        with self._lock:
+            _old = self._entries.pop(_key, None)
+            if _old is not None:
+                self.bytes -= _old.nbytes
+            self._entries[_key] = _array
+            self.bytes += _array.nbytes
+            while self.bytes > self.max_bytes:
+                _, _evicted = self._entries.popitem(last=False)
+                self.bytes -= _evicted.nbytes
+        return _array
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+
+DecodedImages = DecodedImageCache(
+    int(float(os.environ.get("IMAGE_CACHE_MAX_MB", 512)) * 2**20))
@@ -1,19 +1,48 @@
+import numpy as np
+import numpy.typing as npt
 from PIL import Image
+from src.utils.static import parallel_map
+
+
+def overlay_mask(
+    image: Image.Image | npt.NDArray,
+    mask: Image.Image | npt.NDArray,
+    color: tuple[int, int, int] = (255, 0, 0),
+    out: npt.NDArray = None,
+) -> npt.NDArray[np.uint8]:
+    """
+    Tint an RGB image towards `color` by `mask / 510`, the result of an
+    alpha composite of `color` with alpha `mask` followed by a 50% blend.
+
+    Only pixels under the mask are read and written. `out` is a C-contiguous
+    [h, w, 3] uint8 array receiving the result, it may be `image` itself to
+    draw in place; a copy of `image` is returned when omitted.
+    """
+    if isinstance(image, Image.Image) and image.mode != "RGB":
+        image = image.convert("RGB")
+    _image, _mask = np.asarray(image), np.asarray(mask)
+    if out is None:
+        out = np.array(_image)
+    elif out is not _image:
+        np.copyto(out, _image)
+
+    _index = np.flatnonzero(_mask)
+    _pixels = out.reshape(-1, 3)
+    _values = _pixels[_index].astype(np.int32)
+    _alpha = _mask.reshape(-1)[_index].astype(np.int32)[:, np.newaxis]
+    # Rounded (color - value) * alpha / 510, in integers
+    _delta = (np.asarray(color, np.int32) - _values) * _alpha
+    _pixels[_index] = _values + np.floor_divide(_delta + 255, 510)
+    return out
 
 
 def visualize_image_with_mask(
     imgs: list[Image.Image],
     masks: list[Image.Image],
     color: tuple[int, int, int] = (255, 0, 0),
+    workers: int = None,
 ) -> list[Image.Image]:
-    _overlays = []
-    for img, mask in zip(imgs, masks):
-        _red_mask = Image.new("RGB", mask.size, color)
-        _red_mask.putalpha(mask)
-        _red_mask = _red_mask.convert("RGBA")
-        img = img.convert("RGBA")
-        _blend = Image.alpha_composite(img, _red_mask)
-        _overlays.append(Image.blend(
-            img, _blend, alpha=0.5).convert("RGB"))
+    def _overlay(pair) -> Image.Image:
+        return Image.fromarray(overlay_mask(*pair, color=color))
 
-    return _overlays
+    return parallel_map(_overlay, list(zip(imgs, masks)), workers)
@@ -0,0 +1,66 @@
+"""
+In-process metrics, exposed through `/api/metrics`
+"""
+import threading
+from collections import deque
+
+
+class Metric:
+    """Summary of observed values, percentiles over the most recent ones"""
+
+    def __init__(self, window: int = 1024):
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = float("-inf")
+        self.recent = deque(maxlen=window)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.recent.append(value)
+
+    def __percentile(self, values: list[float], q: float) -> float:
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+    def snapshot(self) -> dict:
+        if not self.count:
+            return {"count": 0}
+        _values = sorted(self.recent)
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 4),
+            "min": round(self.min, 4),
+            "max": round(self.max, 4),
+            "p50": round(self.__percentile(_values, 0.5), 4),
+            "p95": round(self.__percentile(_values, 0.95), 4),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: dict[str, Metric] = {}
+        self._counters: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = Metric()
+            self._metrics[name].observe(value)
+
+    def increment(self, name: str, value: int = 1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "metrics": {k: m.snapshot() for k, m in self._metrics.items()},
+            }
+
+
+Metrics = MetricsRegistry()
@@ -1,12 +1,157 @@
+import os
 import logging
+import threading
+from dataclasses import dataclass, field, asdict, fields
+import yaml
 import onnxruntime
 import numpy.typing as npt
+from src.utils.compute import Compute
 
 
-def onnx_interence_session(model_path: str):
-    return onnxruntime.InferenceSession(model_path, providers=[
-        "CPUExecutionProvider", "AzureExecutionProvider"
-    ])
+OnnxConfigPath = os.environ.get(
+    "ONNX_CONFIG", os.path.join(os.getcwd(), "configs", "onnxruntime.yaml"))
+
+GraphOptimizationLevels = {
+    "disable": onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    "basic": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    "extended": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    "all": onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+ExecutionModes = {
+    "sequential": onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    "parallel": onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+@dataclass
+class SessionSettings:
+    """
+    ONNX Runtime session settings of one model.
+
+    Intra-op threads of 0 take the model's `Compute` allotment, inter-op
+    threads of 0 let ONNX Runtime decide. `config_entries`
+    are passed to `SessionOptions.add_session_config_entry`, e.g.
+    `session.intra_op_thread_affinities` or `session.intra_op.allow_spinning`.
+    """
+    providers: list[str] = field(
+        default_factory=lambda: ["CPUExecutionProvider"])
+    intra_op_num_threads: int = 0
+    inter_op_num_threads: int = 0
+    graph_optimization_level: str = "all"
+    execution_mode: str = "sequential"
+    enable_cpu_mem_arena: bool = True
+    enable_mem_pattern: bool = True
+    save_optimized_model: bool = False
+    config_entries: dict[str, str] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SessionSettings":
+        _names = {f.name for f in fields(cls)}
+        _unknown = set(data) - _names
+        if _unknown:
+            raise ValueError(f"Unknown ONNX session settings {_unknown}")
+        return cls(**data)
+
+
+def _env_settings() -> dict:
+    # Environment overrides applied on top of every model's settings
+    _env = {
+        "providers": ("ORT_PROVIDERS", lambda v: v.split(",")),
+        "intra_op_num_threads": ("ORT_INTRA_OP_THREADS", int),
+        "inter_op_num_threads": ("ORT_INTER_OP_THREADS", int),
+        "graph_optimization_level": ("ORT_GRAPH_OPTIMIZATION", str),
+        "execution_mode": ("ORT_EXECUTION_MODE", str),
+        "save_optimized_model": ("ORT_SAVE_OPTIMIZED_MODEL", lambda v: v.lower() in ("1", "true")),
+    }
+    return {k: cast(os.environ[name]) for k, (name, cast) in _env.items() if name in os.environ}
+
+
+_config_lock = threading.Lock()
+_config: dict = None
+
+
+def load_onnx_config(path: str = OnnxConfigPath) -> dict:
+    """
+    Read `{default: {...}, models: {<name>: {...}}}` from YAML, once
+    """
+    global _config
+    with _config_lock:
+        if _config is None:
+            _config = {}
+            if os.path.exists(path):
+                with open(path, "r") as f:
+                    _config = yaml.safe_load(f) or {}
+        return _config
+
+
+def onnx_session_settings(name: str) -> SessionSettings:
+    """
+    Effective settings of model `name`: defaults < YAML default < YAML model < env.
+    Intra-op threads left at 0 take the model's `Compute` allotment.
+    """
+    _yaml = load_onnx_config()
+    _settings = SessionSettings.from_dict({
+        **(_yaml.get("default") or {}),
+        **((_yaml.get("models") or {}).get(name) or {}),
+        **_env_settings(),
+    })
+
+    _allotment = Compute.ort_allotment(name)
+    if _allotment is not None and _settings.intra_op_num_threads == 0:
+        _settings.intra_op_num_threads = _allotment.threads
+        # Threads 1..n-1 pinned to one core each, ids are 1-based.
+        # Thread 0 is the calling thread.
+        if _allotment.cores and _allotment.threads > 1:
+            _settings.config_entries = dict(_settings.config_entries)
+            _settings.config_entries.setdefault("session.intra_op_thread_affinities", ";".join(
+                str(_allotment.cores[i % len(_allotment.cores)] + 1) for i in range(1, _allotment.threads)))
+    return _settings
+
+
+def onnx_session_options(settings: SessionSettings) -> onnxruntime.SessionOptions:
+    _options = onnxruntime.SessionOptions()
+    _options.intra_op_num_threads = settings.intra_op_num_threads
+    _options.inter_op_num_threads = settings.inter_op_num_threads
+    _options.graph_optimization_level = GraphOptimizationLevels[settings.graph_optimization_level]
+    _options.execution_mode = ExecutionModes[settings.execution_mode]
+    _options.enable_cpu_mem_arena = settings.enable_cpu_mem_arena
+    _options.enable_mem_pattern = settings.enable_mem_pattern
+    for _key, _value in settings.config_entries.items():
+        _options.add_session_config_entry(_key, str(_value))
+    return _options
+
+
+def onnx_interence_session(model_path: str, name: str = None):
+    """
+    Create a session configured by `configs/onnxruntime.yaml` (or
+    `ONNX_CONFIG`) and `ORT_*` environment variables. `name` selects the
+    model section, default to the model file name without extension.
+    """
+    name = name or os.path.splitext(os.path.basename(model_path))[0]
+    _settings = onnx_session_settings(name)
+    _options = onnx_session_options(_settings)
+
+    # Only request providers available in this build
+    _available = onnxruntime.get_available_providers()
+    _providers = [p for p in _settings.providers if p in _available] or [
+        "CPUExecutionProvider"]
+
+    # Reuse the graph optimized by a previous start, skip optimizing again.
+    # Fully optimized graphs may contain hardware specific kernels.
+    _model_path = model_path
+    _optimized_path = f"{os.path.splitext(model_path)[0]}.optimized.onnx"
+    if _settings.save_optimized_model:
+        if os.path.exists(_optimized_path) and os.path.getmtime(_optimized_path) >= os.path.getmtime(model_path):
+            _model_path = _optimized_path
+            _options.graph_optimization_level = GraphOptimizationLevels["disable"]
+        else:
+            _options.optimized_model_filepath = _optimized_path
+
+    logging.info(
+        f"🚅 ONNX session {name}: model={os.path.basename(_model_path)}, providers={_providers}, "
+        f"{', '.join(f'{k}={v}' for k, v in asdict(_settings).items() if k != 'providers')}")
+    return onnxruntime.InferenceSession(_model_path, sess_options=_options, providers=_providers)
 
 
 def onnx_inference(session: onnxruntime.InferenceSession, *inputs: npt.NDArray) -> npt.NDArray:
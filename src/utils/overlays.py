@@ -0,0 +1,73 @@
+"""
+Crack overlays rendered on first request from the saved upload and mask.
+
+An overlay file is named `<upload id>_<mask id>.<ext>`, so its sources can
+be found again from the name alone and a rendered file is reused as is.
+"""
+import os
+import re
+import glob
+import uuid
+from PIL import Image
+from src.utils.static import StaticDirectory, ImageEncoders, create_with_directory, load_static
+from src.utils.image_utils import overlay_mask
+
+
+OverlayDirectory = "crackseg_results"
+OverlayName = re.compile(r"^([0-9a-f]{32})_([0-9a-f]{32})\.(\w+)$")
+
+
+def overlay_ext() -> str:
+    _encoder = ImageEncoders.get(OverlayDirectory)
+    return _encoder.ext if _encoder is not None else "png"
+
+
+def overlay_path(upload_path: str, mask_path: str) -> str:
+    """
+    Static path of the overlay of an upload and its crack mask
+    """
+    _upload_id = os.path.splitext(os.path.basename(upload_path))[0]
+    _mask_id = os.path.splitext(os.path.basename(mask_path))[0]
+    return os.path.join(StaticDirectory, OverlayDirectory, f"{_upload_id}_{_mask_id}.{overlay_ext()}")
+
+
+def find_static(directory: str, file_id: str) -> str | None:
+    _paths = glob.glob(os.path.join(StaticDirectory, directory, f"{file_id}.*"))
+    return _paths[0] if _paths else None
+
+
+def render_overlay(name: str) -> str | None:
+    """
+    Return the overlay file `name`, rendering it when it does not exist yet.
+    Existing files are served whatever their name, e.g. `<uuid>.png`
+    overlays saved before lazy rendering. None when the name is invalid or
+    its upload/mask are gone.
+    """
+    if os.path.basename(name) != name or name in ("", ".", ".."):
+        return None
+    _path = os.path.join(StaticDirectory, OverlayDirectory, name)
+    if os.path.isfile(_path):
+        return _path
+
+    _match = OverlayName.match(name)
+    if _match is None or _match.group(3) != overlay_ext():
+        return None
+
+    _upload = find_static("uploads", _match.group(1))
+    _mask = find_static("crackseg_masks", _match.group(2))
+    if _upload is None or _mask is None:
+        return None
+    _overlay = overlay_mask(load_static(_upload), load_static(_mask, mode="L"))
+
+    # Write aside and rename, concurrent renders of one name never expose
+    # a partial file
+    create_with_directory(OverlayDirectory)
+    _tmp_path = f"{_path}.{uuid.uuid4().hex}.tmp"
+    _encoder = ImageEncoders.get(OverlayDirectory)
+    if _encoder is not None:
+        with open(_tmp_path, "wb") as f:
+            f.write(_encoder.encode(_overlay))
+    else:
+        Image.fromarray(_overlay).save(_tmp_path, format="png")
+    os.replace(_tmp_path, _path)
+    return _path
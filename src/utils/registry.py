@@ -0,0 +1,101 @@
+"""
+Process-wide registry of loaded models, shared across requests and controllers.
+
+Controllers look models up here on every call instead of holding them, so
+each model is loaded once. Requests pass their provider explicitly rather
+than switching the controller's default, which concurrent requests share.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Hashable
+
+
+class ModelRegistry:
+    """
+    Load each model once per (name, config) key and reuse it.
+
+    - `max_entries`: keep at most this many models, evicting the least
+      recently used one (0 = unlimited).
+    - `idle_timeout`: drop models not used for this many seconds (0 = never).
+    """
+
+    def __init__(self, max_entries: int = 0, idle_timeout: float = 0):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self._models: OrderedDict[Hashable, list] = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading: dict[Hashable, threading.Lock] = {}
+
+    @staticmethod
+    def _key(name: str, args: tuple, kwargs: dict) -> Hashable:
+        return (name, args, tuple(sorted(kwargs.items())))
+
+    def get(self, name: str, factory: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Return the model for `name` + config, building it with
+        `factory(*args, **kwargs)` on first use.
+        """
+        _key = self._key(name, args, kwargs)
+        self.evict_idle()
+
+        with self._lock:
+            _entry = self._models.get(_key)
+            if _entry is not None:
+                _entry[1] = time.monotonic()
+                self._models.move_to_end(_key)
+                return _entry[0]
+            _load_lock = self._loading.setdefault(_key, threading.Lock())
+
+        # Load outside the registry lock, only one loader per key
+        with _load_lock:
+            with self._lock:
+                _entry = self._models.get(_key)
+                if _entry is not None:
+                    return _entry[0]
+
+            _s = time.time()
+            _model = factory(*args, **kwargs)
+            logging.info(
+                f"📦 Loaded model {name} [{round(time.time() - _s, 2)}s]")
+
+            with self._lock:
+                self._models[_key] = [_model, time.monotonic()]
+                self._loading.pop(_key, None)
+                self.__evict_lru()
+
+        return _model
+
+    def __evict_lru(self):
+        while self.max_entries and len(self._models) > self.max_entries:
+            _key, _ = self._models.popitem(last=False)
+            logging.info(f"📦 Evicted model {_key[0]} (LRU)")
+
+    def evict_idle(self):
+        if not self.idle_timeout:
+            return
+        _now = time.monotonic()
+        with self._lock:
+            for _key in [k for k, (_, last_used) in self._models.items()
+                         if _now - last_used > self.idle_timeout]:
+                del self._models[_key]
+                logging.info(f"📦 Evicted model {_key[0]} (idle)")
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+
+    def __contains__(self, name: str) -> bool:
+        with self._lock:
+            return any(k[0] == name for k in self._models)
+
+    def __len__(self) -> int:
+        return len(self._models)
+
+
+SharedModels = ModelRegistry(
+    max_entries=int(os.environ.get("MODEL_REGISTRY_MAX_ENTRIES", 0)),
+    idle_timeout=float(os.environ.get("MODEL_REGISTRY_IDLE_TIMEOUT", 0)),
+)
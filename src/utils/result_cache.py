@@ -0,0 +1,167 @@
+"""
+Disk-backed cache of model outputs, addressed by input content, provider
+and model version
+"""
+import os
+import glob
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import numpy.typing as npt
+from src.utils.metrics import Metrics
+
+
+def array_hash(array: npt.NDArray) -> str:
+    _array = np.ascontiguousarray(array)
+    _hash = hashlib.blake2b(digest_size=16)
+    _hash.update(f"{_array.dtype}{_array.shape}".encode())
+    _hash.update(_array.data)
+    return _hash.hexdigest()
+
+
+def model_version(path: str) -> str:
+    """
+    Cheap model file fingerprint, changes when the file is replaced
+    """
+    _stat = os.stat(path)
+    return f"{os.path.basename(path)}:{_stat.st_size}:{_stat.st_mtime_ns}"
+
+
+def result_key(*parts: str) -> str:
+    return hashlib.blake2b("|".join(parts).encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """
+    LRU cache of arrays stored as `<namespace>/<key>.npy` under `directory`,
+    with a total byte budget.
+
+    Entries found on disk at startup are indexed by mtime, reads refresh
+    the mtime, so recency survives restarts. `put_later` writes a batch of
+    entries on a background thread, holding at most `max_pending_bytes` of
+    arrays waiting (default `max_bytes`, more would evict itself), entries
+    past that are dropped. Hits, misses and dropped
+    writes are counted as `result_cache.<namespace>.hit|miss|dropped`
+    metrics.
+    """
+
+    def __init__(self, directory: str, max_bytes: int, enabled: bool = True, max_pending_bytes: int = None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.max_pending_bytes = max_pending_bytes or max_bytes
+        self.bytes = 0
+        self.pending_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="result-cache")
+        if enabled:
+            self.__index()
+
+    def __index(self):
+        _paths = glob.glob(os.path.join(self.directory, "*", "*.npy"))
+        for _path in sorted(_paths, key=os.path.getmtime):
+            self._entries[_path] = os.path.getsize(_path)
+            self.bytes += self._entries[_path]
+        logging.info(
+            f"💾 Result cache {self.directory}: {len(self._entries)} entries, {self.bytes / 2**20:.1f} MB")
+
+    def __path(self, namespace: str, key: str) -> str:
+        return os.path.join(self.directory, namespace, f"{key}.npy")
+
+    def get(self, namespace: str, key: str) -> npt.NDArray | None:
+        if not self.enabled:
+            return None
+        _path = self.__path(namespace, key)
+        with self._lock:
+            _hit = _path in self._entries
+            if _hit:
+                self._entries.move_to_end(_path)
+        try:
+            _array = np.load(_path) if _hit else None
+            if _hit:
+                os.utime(_path)
+        except (FileNotFoundError, ValueError):
+            # Evicted meanwhile, or a corrupted file
+            _array = None
+        Metrics.increment(f"result_cache.{namespace}.{'hit' if _array is not None else 'miss'}")
+        return _array
+
+    def put(self, namespace: str, key: str, array: npt.NDArray):
+        if not self.enabled or array.nbytes > self.max_bytes:
+            return
+        _path = self.__path(namespace, key)
+        os.makedirs(os.path.dirname(_path), exist_ok=True)
+
+        # Write aside and rename, readers never see a partial file
+        _tmp_path = f"{_path}.{uuid.uuid4().hex}.tmp"
+        with open(_tmp_path, "wb") as f:
+            np.save(f, array)
+        os.replace(_tmp_path, _path)
+        _size = os.path.getsize(_path)
+
+        _evicted = []
+        with self._lock:
+            self.bytes += _size - self._entries.pop(_path, 0)
+            self._entries[_path] = _size
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _old_path, _old_size = self._entries.popitem(last=False)
+                self.bytes -= _old_size
+                _evicted.append(_old_path)
+        for _old_path in _evicted:
+            try:
+                os.remove(_old_path)
+            except FileNotFoundError:
+                pass
+
+    def __put_all(self, namespace: str, entries: list[tuple[str, npt.NDArray]], size: int):
+        try:
+            for _key, _array in entries:
+                self.put(namespace, _key, _array)
+        finally:
+            with self._lock:
+                self.pending_bytes -= size
+
+    def put_later(self, namespace: str, entries: list[tuple[str, npt.NDArray]]):
+        """
+        `put` every (key, array) in one job on the background writer, so
+        callers (e.g. inference pools) do not wait for the disk. Arrays must
+        not be modified afterwards.
+        """
+        if not self.enabled or not entries:
+            return
+        _accepted, _size = [], 0
+        with self._lock:
+            for _key, _array in entries:
+                if self.pending_bytes + _array.nbytes > self.max_pending_bytes:
+                    continue
+                self.pending_bytes += _array.nbytes
+                _size += _array.nbytes
+                _accepted.append((_key, _array))
+        if len(_accepted) < len(entries):
+            Metrics.increment(f"result_cache.{namespace}.dropped", len(entries) - len(_accepted))
+        if _accepted:
+            self._writer.submit(self.__put_all, namespace, _accepted, _size)
+
+    def clear(self):
+        with self._lock:
+            _paths = list(self._entries)
+            self._entries.clear()
+            self.bytes = 0
+        for _path in _paths:
+            try:
+                os.remove(_path)
+            except FileNotFoundError:
+                pass
+
+
+Results = ResultCache(
+    os.environ.get("RESULT_CACHE_DIR", os.path.join(os.getcwd(), "cache", "results")),
+    int(float(os.environ.get("RESULT_CACHE_MAX_MB", 1024)) * 2**20),
+    enabled=os.environ.get("RESULT_CACHE", "1").lower() in ("1", "true"),
+    max_pending_bytes=int(float(os.environ.get("RESULT_CACHE_MAX_PENDING_MB", 0)) * 2**20),
+)
@@ -0,0 +1,137 @@
+"""
+Pluggable storage of per-client session data
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import threading
+from abc import abstractmethod
+from collections import OrderedDict
+from src.utils.static import StaticDirectory
+
+
+class SessionStore:
+    @abstractmethod
+    def get(self, client_id: str) -> dict:
+        """
+        Return a copy of the client data, empty if unknown.
+        """
+
+    @abstractmethod
+    def merge(self, client_id: str, data: dict) -> dict:
+        """
+        Atomically update the client data with `data`, return the result.
+        """
+
+
+class MemorySessionStore(SessionStore):
+    """In-process store keeping the `max_clients` most recently used clients"""
+
+    def __init__(self, max_clients: int = 10000):
+        self.max_clients = max_clients
+        self._clients: OrderedDict[str, dict] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, client_id: str) -> dict:
+        with self._lock:
+            if client_id not in self._clients:
+                return {}
+            self._clients.move_to_end(client_id)
+            return dict(self._clients[client_id])
+
+    def merge(self, client_id: str, data: dict) -> dict:
+        with self._lock:
+            _data = self._clients.pop(client_id, {})
+            _data.update(data)
+            self._clients[client_id] = _data
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+            return dict(_data)
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite store in WAL mode with one row per client.
+
+    Merges run in an IMMEDIATE transaction, so concurrent requests of the
+    same client never lose each other's updates.
+    """
+
+    def __init__(self, path: str, legacy_json: str = None):
+        self.path = path
+        self._local = threading.local()
+        with self.__connection() as _conn:
+            _conn.execute(
+                "CREATE TABLE IF NOT EXISTS clients "
+                "(id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+        if legacy_json:
+            self.__import_json(legacy_json)
+
+    def __connection(self) -> sqlite3.Connection:
+        _conn = getattr(self._local, "conn", None)
+        if _conn is None:
+            _conn = sqlite3.connect(
+                self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            _conn.execute("PRAGMA journal_mode=WAL")
+            _conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = _conn
+        return _conn
+
+    def __import_json(self, path: str):
+        # One-off migration from the legacy data.json store
+        if not os.path.exists(path):
+            return
+        _conn = self.__connection()
+        if _conn.execute("SELECT 1 FROM clients LIMIT 1").fetchone():
+            return
+        with open(path, "r") as f:
+            _clients = json.load(f)
+        _now = time.time()
+        _conn.execute("BEGIN IMMEDIATE")
+        _conn.executemany(
+            "INSERT OR IGNORE INTO clients (id, data, updated_at) VALUES (?, ?, ?)",
+            [(k, json.dumps(v), _now) for k, v in _clients.items()])
+        _conn.execute("COMMIT")
+        logging.info(f"Imported {len(_clients)} clients from {path}")
+
+    def get(self, client_id: str) -> dict:
+        _row = self.__connection().execute(
+            "SELECT data FROM clients WHERE id = ?", (client_id,)).fetchone()
+        return json.loads(_row[0]) if _row else {}
+
+    def merge(self, client_id: str, data: dict) -> dict:
+        _conn = self.__connection()
+        _conn.execute("BEGIN IMMEDIATE")
+        try:
+            _row = _conn.execute(
+                "SELECT data FROM clients WHERE id = ?", (client_id,)).fetchone()
+            _data = json.loads(_row[0]) if _row else {}
+            _data.update(data)
+            _conn.execute(
+                "INSERT INTO clients (id, data, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                (client_id, json.dumps(_data), time.time()))
+            _conn.execute("COMMIT")
+        except BaseException:
+            _conn.execute("ROLLBACK")
+            raise
+        return _data
+
+
+def create_session_store() -> SessionStore:
+    """
+    Build the store selected by `SESSION_STORE` (`sqlite` or `memory`)
+    """
+    _kind = os.environ.get("SESSION_STORE", "sqlite")
+    if _kind == "memory":
+        return MemorySessionStore(int(os.environ.get("SESSION_MAX_CLIENTS", 10000)))
+    elif _kind == "sqlite":
+        _dir = os.path.join(os.getcwd(), StaticDirectory)
+        os.makedirs(_dir, exist_ok=True)
+        return SQLiteSessionStore(
+            os.environ.get("SESSION_DB", os.path.join(_dir, "sessions.db")),
+            legacy_json=os.path.join(_dir, "data.json"))
+    else:
+        raise ValueError(f"Session store {_kind} invalid")
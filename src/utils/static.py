@@ -2,11 +2,103 @@ import os
 import io
 import uuid
 import shutil
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Callable
+import cv2 as cv
 import numpy as np
 from PIL import Image
+from src.utils.image_cache import DecodedImages
 
 
 StaticDirectory = "data"
+UploadChunkSize = 1024 * 1024
+
+# PIL and OpenCV codecs release the GIL, so decode/encode scale with threads
+StaticWorkers = int(os.environ.get(
+    "STATIC_IO_WORKERS", min(8, os.cpu_count() or 1)))
+StaticPool = ThreadPoolExecutor(
+    max_workers=StaticWorkers, thread_name_prefix="static-io")
+
+
+class UploadTooLarge(Exception):
+    """Raised when an upload exceeds its size limit"""
+
+
+@dataclass
+class ImageEncoder:
+    """
+    OpenCV encoder used instead of PIL for a static directory.
+
+    - `ext`: `png`, `jpg` or `webp`
+    - `quality`: PNG compression level (0-9) or JPEG/WebP quality (0-100)
+    """
+    ext: str = "png"
+    quality: int = 1
+    params: list[int] = field(init=False)
+
+    def __post_init__(self):
+        if self.ext == "png":
+            self.params = [cv.IMWRITE_PNG_COMPRESSION, self.quality]
+        elif self.ext in ("jpg", "jpeg"):
+            self.params = [cv.IMWRITE_JPEG_QUALITY, self.quality]
+        elif self.ext == "webp":
+            self.params = [cv.IMWRITE_WEBP_QUALITY, self.quality]
+        else:
+            raise ValueError(f"Encoder {self.ext} invalid")
+
+    def encode(self, image: Image.Image | np.ndarray) -> bytes:
+        _array = np.asarray(image)
+        if _array.ndim == 3:
+            # OpenCV expects BGR(A)
+            _code = cv.COLOR_RGBA2BGRA if _array.shape[2] == 4 else cv.COLOR_RGB2BGR
+            _array = cv.cvtColor(_array, _code)
+        _ok, _buffer = cv.imencode(f".{self.ext}", _array, self.params)
+        if not _ok:
+            raise ValueError(f"Failed to encode image as {self.ext}")
+        return _buffer.tobytes()
+
+
+def parse_encoders(config: str) -> dict[str, ImageEncoder]:
+    """
+    Parse `directory=ext[:quality],...`, e.g. `crackseg_results=jpg:90`
+    """
+    _encoders = {}
+    for _item in filter(None, config.split(",")):
+        _directory, _spec = _item.strip().split("=")
+        _ext, _, _quality = _spec.partition(":")
+        _encoders[_directory] = ImageEncoder(
+            _ext, int(_quality)) if _quality else ImageEncoder(_ext)
+    return _encoders
+
+
+# Directories not listed here are saved with PIL
+ImageEncoders: dict[str, ImageEncoder] = parse_encoders(os.environ.get(
+    "STATIC_ENCODERS", "crackseg_masks=png:1,crackseg_results=png:1,restore=png:1"))
+
+
+def register_encoder(directory: str, encoder: ImageEncoder | None):
+    if encoder is None:
+        ImageEncoders.pop(directory, None)
+    else:
+        ImageEncoders[directory] = encoder
+
+
+def parallel_map(fn: Callable, items: list, workers: int = None) -> list:
+    """
+    Map `fn` over `items` on the shared static pool, keeping order.
+    At most `workers` calls of this map run at once.
+    """
+    _workers = min(workers or StaticWorkers, len(items))
+    if _workers <= 1:
+        return [fn(item) for item in items]
+
+    # One contiguous chunk per worker
+    _size = -(-len(items) // _workers)
+    _chunks = [items[i:i + _size] for i in range(0, len(items), _size)]
+    _futures = [StaticPool.submit(lambda c: [fn(item) for item in c], chunk)
+                for chunk in _chunks]
+    return [r for f in _futures for r in f.result()]
 
 
 def create_directory(path: str) -> str:
@@ -29,9 +121,44 @@ def save_file(directory: str, file: io.BytesIO, file_ext: str, expiration=None)
     return _file_path
 
 
+def save_stream(directory: str, file: io.BytesIO, file_ext: str, max_bytes: int, chunk_size: int = UploadChunkSize) -> tuple[str, int]:
+    """
+    Copy `file` to disk chunk by chunk, return (path, size).
+    The partial file is removed if it grows past `max_bytes`.
+    """
+    _path = os.path.join(StaticDirectory, directory)
+    create_directory(_path)
+    _file_name = f"{uuid.uuid4().hex}.{file_ext}"
+    _file_path = os.path.join(_path, _file_name)
+
+    _size = 0
+    try:
+        with open(_file_path, 'wb') as f:
+            while _chunk := file.read(chunk_size):
+                _size += len(_chunk)
+                if _size > max_bytes:
+                    raise UploadTooLarge(
+                        f"Upload exceeds the limit of {max_bytes} bytes")
+                f.write(_chunk)
+    except BaseException:
+        os.remove(_file_path)
+        raise
+
+    return _file_path, _size
+
+
 def save_image(directory: str, image: Image.Image, expiration=None) -> str:
     _path = os.path.join(StaticDirectory, directory)
     create_directory(_path)
+    _encoder = ImageEncoders.get(directory)
+
+    # Fast path through OpenCV when the directory has an encoder
+    if _encoder is not None and isinstance(image, Image.Image):
+        _file_path = os.path.join(_path, f"{uuid.uuid4().hex}.{_encoder.ext}")
+        with open(_file_path, 'wb') as f:
+            f.write(_encoder.encode(image))
+        return _file_path
+
     _ext = image.format.lower() if image.format else 'png'
     _file_name = f"{uuid.uuid4().hex}.{_ext}"
     _file_path = os.path.join(_path, _file_name)
@@ -39,16 +166,35 @@ def save_image(directory: str, image: Image.Image, expiration=None) -> str:
     return _file_path
 
 
-def save_images(directory: str, images: list[Image.Image], expiration=None) -> list[str]:
-    _paths = []
-    for image in images:
-        _paths.append(save_image(directory, image, expiration))
-    return _paths
+def save_images(directory: str, images: list[Image.Image], expiration=None, cache=False, workers: int = None) -> list[str]:
+    """
+    Save images in parallel, optionally keeping their decoded arrays in the
+    image cache so the next `loads_static` on them skips decoding
+    """
+    def _save(image: Image.Image) -> str:
+        _path = save_image(directory, image, expiration)
+        if cache:
+            DecodedImages.put(_path, image.mode, np.asarray(image))
+        return _path
+
+    return parallel_map(_save, images, workers)
+
+
+def load_static(path: str, mode="RGB") -> np.ndarray:
+    """
+    Decode an image once, later loads are served from the image cache
+    """
+    _path = os.path.join(os.getcwd(), path)
+    _img = DecodedImages.get(_path, mode)
+    if _img is None:
+        _img = DecodedImages.put(
+            _path, mode, np.asarray(Image.open(_path).convert(mode)))
+    return _img
 
 
-def loads_static(paths: list[str], mode="RGB", type="pil") -> list[Image.Image] | list[np.ndarray]:
-    _imgs = [Image.open(os.path.join(os.getcwd(), path)).convert(mode)
-             for path in paths]
+def loads_static(paths: list[str], mode="RGB", type="pil", workers: int = None) -> list[Image.Image] | list[np.ndarray]:
+    _imgs = parallel_map(lambda path: load_static(path, mode), paths, workers)
     if type == "np":
-        return [np.array(img) for img in _imgs]
-    return _imgs
+        # Cached arrays are shared and read-only
+        return _imgs
+    return [Image.fromarray(img) for img in _imgs]
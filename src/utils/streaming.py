@@ -0,0 +1,89 @@
+"""
+Async text streaming helpers for HTTP responses
+"""
+import json
+import time
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable
+
+
+async def coalesce(
+    pieces: AsyncIterator[str],
+    max_delay_ms: float = 50,
+    max_bytes: int = 256,
+) -> AsyncIterator[str]:
+    """
+    Merge small pieces into chunks flushed every `max_delay_ms` or once
+    `max_bytes` are buffered, whichever comes first. The next piece is
+    awaited while a partial chunk waits, so a slow producer never delays a
+    flush. Each yield waits for the consumer (the ASGI send), so a slow
+    client slows reading from `pieces` instead of growing a backlog.
+    """
+    _iterator = pieces.__aiter__()
+    _buffer, _size, _deadline = [], 0, None
+    _next = None
+    try:
+        while True:
+            if _next is None:
+                _next = asyncio.ensure_future(_iterator.__anext__())
+            _timeout = None if _deadline is None else max(0, _deadline - time.perf_counter())
+            _done, _ = await asyncio.wait({_next}, timeout=_timeout)
+
+            if _done:
+                try:
+                    _piece = _next.result()
+                except StopAsyncIteration:
+                    break
+                finally:
+                    _next = None
+                if not _piece:
+                    continue
+                _buffer.append(_piece)
+                _size += len(_piece.encode())
+                if _deadline is None:
+                    _deadline = time.perf_counter() + max_delay_ms / 1000
+                if _size < max_bytes:
+                    continue
+
+            # Size or delay reached
+            if _buffer:
+                yield "".join(_buffer)
+            _buffer, _size, _deadline = [], 0, None
+
+        if _buffer:
+            yield "".join(_buffer)
+    finally:
+        # Settle a pending read before closing its generator
+        if _next is not None:
+            _next.cancel()
+            await asyncio.gather(_next, return_exceptions=True)
+        if hasattr(_iterator, "aclose"):
+            await _iterator.aclose()
+
+
+async def until_disconnected(
+    chunks: AsyncIterator[str],
+    is_disconnected: Callable[[], Awaitable[bool]],
+) -> AsyncIterator[str]:
+    """
+    Stop pulling `chunks` (closing it) once the client has gone
+    """
+    _iterator = chunks.__aiter__()
+    try:
+        async for _chunk in _iterator:
+            if await is_disconnected():
+                break
+            yield _chunk
+    finally:
+        if hasattr(_iterator, "aclose"):
+            await _iterator.aclose()
+
+
+async def sse(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """
+    Server-sent events, one `data: {"content": ...}` event per chunk and a
+    final `done` event
+    """
+    async for _chunk in chunks:
+        yield f"data: {json.dumps({'content': _chunk}, ensure_ascii=False)}\n\n"
+    yield "event: done\ndata: {}\n\n"
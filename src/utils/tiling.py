@@ -0,0 +1,88 @@
+"""
+Split large images into overlapping tiles and merge tile predictions back
+"""
+from typing import Iterator
+import cv2 as cv
+import numpy as np
+import numpy.typing as npt
+
+
+def tile_starts(length: int, tile: int, overlap: int) -> list[int]:
+    """
+    Start offsets covering `length` with tiles of `tile` px overlapping
+    by at least `overlap` px. The last tile is snapped to the edge.
+    """
+    if length <= tile:
+        return [0]
+    _stride = max(1, tile - overlap)
+    _starts = list(range(0, length - tile, _stride))
+    return _starts + [length - tile]
+
+
+def iter_tiles(
+    image: npt.NDArray,
+    tile_size: tuple[int, int],
+    overlap: int
+) -> Iterator[tuple[int, int, npt.NDArray, tuple[int, int]]]:
+    """
+    Lazily yield (y, x, tile, (h, w)) over an HWC image. Tiles are views,
+    except at edges of images smaller than the tile, where they are
+    reflect-padded to `tile_size`; (h, w) is the unpadded size.
+    """
+    _tile_h, _tile_w = tile_size
+    _height, _width = image.shape[:2]
+    for y in tile_starts(_height, _tile_h, overlap):
+        for x in tile_starts(_width, _tile_w, overlap):
+            _tile = image[y:y + _tile_h, x:x + _tile_w]
+            _h, _w = _tile.shape[:2]
+            if (_h, _w) != (_tile_h, _tile_w):
+                _tile = cv.copyMakeBorder(
+                    _tile, 0, _tile_h - _h, 0, _tile_w - _w, cv.BORDER_REFLECT_101)
+            yield y, x, _tile, (_h, _w)
+
+
+def feather_window(height: int, width: int, overlap: int) -> npt.NDArray[np.float32]:
+    """
+    Weights ramping linearly from the tile borders over `overlap` px
+    """
+    def _ramp(n: int) -> npt.NDArray[np.float32]:
+        _i = np.arange(n, dtype=np.float32)
+        return np.clip(np.minimum(_i + 1, n - _i) / max(1, overlap), 0, 1)
+
+    return np.outer(_ramp(height), _ramp(width))
+
+
+class TileMerger:
+    """
+    Accumulate tile probability maps into one full-resolution map.
+
+    - `feather`: weighted average with `feather_window` weights
+    - `max`: per-pixel maximum over overlapping tiles
+    """
+
+    def __init__(self, height: int, width: int, mode: str = "feather", window: npt.NDArray = None):
+        if mode not in ("feather", "max"):
+            raise ValueError(f"Merge mode {mode} invalid")
+        self.mode = mode
+        self.window = window
+        self.prob = np.zeros((height, width), dtype=np.float32)
+        self.weight = np.zeros(
+            (height, width), dtype=np.float32) if mode == "feather" else None
+
+    def add(self, prob: npt.NDArray[np.float32], y: int, x: int):
+        _h, _w = prob.shape
+        _region = self.prob[y:y + _h, x:x + _w]
+        if self.mode == "max":
+            np.maximum(_region, prob, out=_region)
+            return
+
+        _window = self.window[:_h, :_w]
+        _region += prob * _window
+        self.weight[y:y + _h, x:x + _w] += _window
+
+    def result(self) -> npt.NDArray[np.float32]:
+        if self.mode == "feather":
+            np.divide(self.prob, self.weight, out=self.prob,
+                      where=self.weight > 0)
+            self.weight = None
+        return self.prob
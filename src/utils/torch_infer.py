@@ -1,14 +1,23 @@
+import os
 import logging
+import hashlib
+import threading
 import torch
-from typing import Tuple, Union
+from typing import Callable, Tuple, Union
+from src.utils.compute import Compute
 
 
 torch.backends.cudnn.benchmark = True
 AvailableDevice = "cuda" if torch.cuda.is_available() else "cpu"
+Compute.configure_torch()
+
+# `eager` or `script` (traced, frozen TorchScript cached under `models/`)
+TorchCompileMode = os.environ.get("TORCH_COMPILE", "eager")
 
 
 def torch_inference(model: torch.nn.Module, *tensors: torch.Tensor):
     global AvailableDevice
+    Compute.pin_torch_thread()
 
     # Cast model, tensor to GPU
     if AvailableDevice == "cuda":
@@ -21,8 +30,9 @@ def torch_inference(model: torch.nn.Module, *tensors: torch.Tensor):
         if next(model.parameters()).device.type != "cuda":
             model = model.to(torch.device("cuda"), non_blocking=True)
 
-    # Inference
-    model.eval()
+    # Inference, models are put in eval mode once when loaded
+    if model.training:
+        model.eval()
     with torch.inference_mode():
         outputs: Union[torch.Tensor, Tuple[torch.Tensor]] = model(*tensors)
 
@@ -34,3 +44,75 @@ def torch_inference(model: torch.nn.Module, *tensors: torch.Tensor):
             outputs = outputs.cpu()
 
     return outputs
+
+
+def file_hash(path: str) -> str:
+    _hash = hashlib.sha256()
+    with open(path, "rb") as f:
+        for _chunk in iter(lambda: f.read(2**20), b""):
+            _hash.update(_chunk)
+    return _hash.hexdigest()[:16]
+
+
+class ScriptedModel(torch.nn.Module):
+    """
+    Traced and frozen TorchScript copy of an eager model, cached on disk as
+    `models/<name>.<hash>.ts`.
+
+    The model builds its tensors from the input shapes, so the traced graph
+    runs on any batch and H/W: one module (one copy of the frozen weights)
+    serves every shape. It is built on first use or ahead of time by
+    `warmup`. The file name holds the weights hash, so new weights never
+    load a stale graph.
+    """
+
+    def __init__(self, model: torch.nn.Module, name: str, weights_path: str):
+        super().__init__()
+        self.model = model.eval()
+        self.name = name
+        self.hash = file_hash(weights_path)
+        self.path = os.path.join(
+            os.path.dirname(os.path.abspath(weights_path)), f"{name}.{self.hash}.ts")
+        self._scripted: torch.jit.ScriptModule = None
+        self._lock = threading.Lock()
+
+    def __build(self, tensors: tuple) -> torch.jit.ScriptModule:
+        if os.path.exists(self.path):
+            logging.info(f"🔥 Load TorchScript {os.path.basename(self.path)}")
+            return torch.jit.load(self.path, map_location=AvailableDevice)
+
+        logging.info(f"🔥 Trace TorchScript {os.path.basename(self.path)}")
+        with torch.no_grad():
+            _traced = torch.jit.trace(self.model, tensors, check_trace=False)
+            _frozen = torch.jit.freeze(_traced)
+        torch.jit.save(_frozen, self.path)
+        return _frozen
+
+    def module(self, *tensors: torch.Tensor) -> torch.jit.ScriptModule:
+        if self._scripted is None:
+            with self._lock:
+                if self._scripted is None:
+                    self._scripted = self.__build(tensors)
+        return self._scripted
+
+    def forward(self, *tensors: torch.Tensor):
+        return self.module(*tensors)(*tensors)
+
+    def warmup(self, example_inputs: Callable[[int, int, int], tuple], shapes: list[tuple[int, int, int]]):
+        """
+        Build the module and run it on every (batch, height, width) in
+        `shapes`, the profiling executor optimizes the graph over the first
+        two runs and allocators grow to the largest shape
+        """
+        for _shape in shapes:
+            _tensors = [t.to(AvailableDevice) for t in example_inputs(*_shape)]
+            with torch.inference_mode():
+                for _ in range(2):
+                    self(*_tensors)
+
+
+def parse_shapes(value: str) -> list[tuple[int, int, int]]:
+    """
+    `1x512x512,4x256x256` to [(1, 512, 512), (4, 256, 256)]
+    """
+    return [tuple(int(d) for d in s.split("x")) for s in value.split(",") if s]
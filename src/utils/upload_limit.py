@@ -0,0 +1,46 @@
+"""
+Reject oversized uploads from their Content-Length before the body is read
+"""
+from starlette import status
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+
+class UploadSizeLimit:
+    """
+    Pure ASGI middleware, requests to other paths pass straight through
+    without wrapping their body or response.
+
+    - `path`: upload route to guard
+    - `max_bytes`: largest accepted Content-Length, 413 above it and 400
+      when the header is malformed
+    """
+
+    def __init__(self, app: ASGIApp, path: str, max_bytes: int):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        _response = self.__check(dict(scope["headers"]).get(b"content-length"))
+        if _response is None:
+            return await self.app(scope, receive, send)
+        await _response(scope, receive, send)
+
+    def __check(self, length: bytes | None) -> JSONResponse | None:
+        if not length:
+            return None
+        try:
+            _length = int(length)
+        except ValueError:
+            return JSONResponse(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                content={"detail": "Invalid Content-Length header"})
+        if _length > self.max_bytes:
+            return JSONResponse(
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                content={"detail": f"Request exceeds the limit of {self.max_bytes} bytes"})
+        return None
@@ -0,0 +1,43 @@
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("onnx")
+pytest.importorskip("onnxruntime")
+
+import numpy as np
+from scripts.export_crfill_onnx import export
+from src.controllers.restoration.crfill.model import BaseConvGenerator
+from src.utils.onnx_infer import onnx_interence_session, onnx_inference
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    return BaseConvGenerator().eval()
+
+
+@pytest.fixture(scope="module")
+def session(model, tmp_path_factory):
+    _path = str(tmp_path_factory.mktemp("crfill") / "crfill.onnx")
+    export(model, _path, opset=17, size=(64, 64))
+    return onnx_interence_session(_path, name="crfill")
+
+
+def test_exported_axes_are_dynamic(session):
+    _shape = session.get_inputs()[0].shape
+    assert not any(isinstance(_dim, int) for _dim in (_shape[0], _shape[2], _shape[3]))
+
+
+@pytest.mark.parametrize("batch, height, width", [(1, 64, 64), (2, 96, 128)])
+def test_exported_matches_eager(model, session, batch, height, width):
+    _rng = np.random.default_rng(0)
+    _images = _rng.random((batch, 3, height, width), dtype=np.float32)
+    _masks = (_rng.random((batch, 1, height, width)) > 0.8).astype(np.float32)
+
+    with torch.inference_mode():
+        _expected = model(torch.from_numpy(_images), torch.from_numpy(_masks)).numpy()
+    _actual = onnx_inference(session, _images, _masks)
+
+    # Outputs are on the 0-255 scale
+    assert _actual.shape == _expected.shape
+    assert np.abs(_expected - _actual).max() <= 1.0
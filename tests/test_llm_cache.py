@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("langchain_google_genai")
+
+from src.controllers.llm._cache import ResponseCache, same_question, normalize_question
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Đồ vật này có từ thời nhà Lý không?", "Đồ vật này có từ thời nhà Lê không?"),
+    ("Phòng trưng bày ở tầng 1 có gì?", "Phòng trưng bày ở tầng 2 có gì?"),
+    ("Trống có từ thế kỷ 12 không?", "Trống có từ thế kỷ 13 không?"),
+    ("Trống nặng bao nhiêu kg?", "Trống bao nhiêu kg nặng?"),
+])
+def test_near_match_refuses_different_questions(cached, asked):
+    _cache = ResponseCache(100, 60, threshold=0.9)
+    _cache.put("gemini", cached, "knowledge", "answer")
+    assert not same_question(normalize_question(cached), normalize_question(asked))
+    assert _cache.get("gemini", asked, "knowledge") is None
+
+
+def test_near_match_serves_typos():
+    _cache = ResponseCache(100, 60, threshold=0.5)
+    _cache.put("gemini", "Hiện nay trống được trưng bày ở đâu?", "knowledge", "answer")
+    _entry = _cache.get("gemini", "hiện nay trống được trung bày ở đâu", "knowledge")
+    assert _entry is not None and _entry.answer == "answer"
+
+
+def test_exact_match_only_by_default():
+    _cache = ResponseCache(100, 60)
+    _cache.put("gemini", "Trống nặng bao nhiêu kg?", "knowledge", "answer")
+    assert _cache.get("gemini", "  trống NẶNG bao nhiêu kg ", "knowledge").answer == "answer"
+    assert _cache.get("gemini", "Trống nặng bao nhiêu kg", "other knowledge") is None
+    assert _cache.get("gpt", "Trống nặng bao nhiêu kg", "knowledge") is None
+    assert _cache.get("gemini", "Trống nặng bao nhiêu gam?", "knowledge") is None